@@ -1,7 +1,11 @@
 import streamlit as st
+from crop_prediction import start_background_warm_up
+from instrumentation import debug_panel
 
 
 st.set_page_config("AgriPulse: Crop Yield and Prediction App", page_icon=":home:")
+start_background_warm_up()
+debug_panel()
 # st.title("Welcome")
 # st.subheader("Test code")
 
@@ -0,0 +1,63 @@
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from crop_prediction import FEATURE_COLUMNS, predict_batch
+from instrumentation import print_summary
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+# Scores a planting plan csv in chunks so memory stays bounded by the chunk size.
+# Every chunk goes through the same encoders and model as the prediction page and
+# is appended to the output csv as soon as it is scored.
+def score_csv(input_file, output_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    start = time.perf_counter()
+    total_rows = 0
+    unknown_rows = 0
+    with pd.read_csv(input_file, chunksize=chunk_size) as reader:
+        for chunk_number, chunk in enumerate(reader):
+            missing_columns = [column for column in FEATURE_COLUMNS if column not in chunk]
+            if missing_columns:
+                raise ValueError(f"{input_file} is missing the columns: {', '.join(missing_columns)}")
+
+            predictions = predict_batch(chunk)
+            first_chunk = chunk_number == 0
+            predictions.to_csv(output_file, mode="w" if first_chunk else "a", header=first_chunk, index=False)
+
+            total_rows += len(chunk)
+            unknown_rows += int((~predictions["Known"]).sum())
+            elapsed = time.perf_counter() - start
+            print(f"Scored {total_rows} rows ({total_rows / elapsed:,.0f} rows/sec)")
+
+    elapsed = time.perf_counter() - start
+    print(f"\nDone: {total_rows} rows in {elapsed:.2f} s ({total_rows / max(elapsed, 1e-9):,.0f} rows/sec)")
+    if unknown_rows:
+        print(f"{unknown_rows} rows use a district, season or crop the model has not seen and have no prediction.")
+    return total_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Predict production and MSP revenue for every row of a csv with "
+        + ", ".join(FEATURE_COLUMNS)
+        + " columns."
+    )
+    parser.add_argument("input_file", help="csv file with the planting plan")
+    parser.add_argument("output_file", help="csv file to write the predictions to")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"number of rows scored at a time (default {DEFAULT_CHUNK_SIZE})",
+    )
+    args = parser.parse_args()
+
+    try:
+        score_csv(args.input_file, args.output_file, args.chunk_size)
+        print_summary()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,142 @@
+import threading
+
+import pandas as pd
+
+import geocode_store
+from crop_data import get_crop_data_version
+from crop_index import CropIndex, get_crop_index
+from instrumentation import timed
+from map_layers import year_layer_data
+
+# Approximate district coordinates used where geocoding found nothing
+_FALLBACK_COORDINATES = {
+    'Maharashtra': {
+        'AHMEDNAGAR': [19.0952, 74.7496],
+        'AKOLA': [20.7006, 77.0086],
+        'AMRAVATI': [20.9374, 77.7796],
+        'AURANGABAD': [19.8762, 75.3433],
+        'BEED': [18.9894, 75.7564],
+        'BHANDARA': [21.1702, 79.6539],
+        'BULDHANA': [20.5313, 76.1829],
+        'CHANDRAPUR': [19.9615, 79.2961],
+        'DHULE': [20.9013, 74.7774],
+        'GADCHIROLI': [20.1806, 80.0039],
+        'GONDIA': [21.4602, 80.1920],
+        'HINGOLI': [19.7146, 77.1424],
+        'JALGAON': [21.0077, 75.5626],
+        'JALNA': [19.8410, 75.8864],
+        'KOLHAPUR': [16.7050, 74.2433],
+        'LATUR': [18.4088, 76.5604],
+        'MUMBAI': [19.0760, 72.8777],
+        'NAGPUR': [21.1458, 79.0882],
+        'NANDED': [19.1383, 77.3210],
+        'NANDURBAR': [21.3707, 74.2409],
+        'NASHIK': [19.9975, 73.7898],
+        'OSMANABAD': [18.1814, 76.0419],
+        'PALGHAR': [19.6969, 72.7654],
+        'PARBHANI': [19.2460, 76.4408],
+        'PUNE': [18.5204, 73.8567],
+        'RAIGAD': [18.5158, 73.1829],
+        'RATNAGIRI': [16.9944, 73.3002],
+        'SANGLI': [16.8524, 74.5815],
+        'SATARA': [17.6805, 74.0183],
+        'SINDHUDURG': [16.3615, 73.4004],
+        'SOLAPUR': [17.6599, 75.9064],
+        'THANE': [19.2183, 72.9781],
+        'WARDHA': [20.7453, 78.6022],
+        'WASHIM': [20.1110, 77.1330],
+        'YAVATMAL': [20.4009, 78.1339]
+    },
+    'Andaman and Nicobar Islands': {
+        'NICOBARS': [7.1395, 93.7947],
+        'NORTH AND MIDDLE ANDAMAN': [12.9044, 92.9396],
+        'SOUTH ANDAMANS': [11.7401, 92.6586]
+    }
+}
+
+
+# The fallback coordinates as a typed table indexed by (State_Name, District_Name)
+def _fallback_table(coordinates):
+    rows = [
+        (state, district, lat, lon)
+        for state, districts in coordinates.items()
+        for district, (lat, lon) in districts.items()
+    ]
+    table = pd.DataFrame(rows, columns=["State_Name", "District_Name", "lat", "lon"])
+    return table.astype({"lat": "float64", "lon": "float64"}).set_index(["State_Name", "District_Name"])
+
+
+FALLBACK_COORDINATES = _fallback_table(_FALLBACK_COORDINATES)
+
+
+# Coordinates of every district of a state: stored ones first, gaps filled from the
+# fallback table in one vectorized step. Filled districts are written back to the
+# geocode database as manual rows. Returns the coordinates with their status and
+# the districts that were filled.
+def resolve_coordinates(state):
+    stored = geocode_store.get_state_coordinates(state).set_index("District_Name")
+    if state in FALLBACK_COORDINATES.index.get_level_values("State_Name"):
+        fallback = FALLBACK_COORDINATES.loc[state]
+    else:
+        fallback = FALLBACK_COORDINATES.iloc[:0].droplevel("State_Name")
+
+    located = stored.index[stored["lat"].notna() & stored["lon"].notna()]
+    filled = fallback.index.difference(located)
+    resolved = stored[["lat", "lon"]].combine_first(fallback)
+    resolved["status"] = stored["status"]
+    resolved.loc[filled, "status"] = geocode_store.MANUAL
+    if len(filled):
+        fallback_rows = fallback.loc[filled]
+        geocode_store.save_coordinates(
+            state,
+            list(zip(filled, fallback_rows["lat"], fallback_rows["lon"], [geocode_store.MANUAL] * len(filled))),
+        )
+    resolved.index.name = "District_Name"
+    return resolved.reset_index(), list(filled)
+
+
+# The crop rows of one state joined with their coordinates, indexed for filtering
+class StateMap:
+    @timed("map.state_join")
+    def __init__(self, state):
+        self.coordinates, self.filled_districts = resolve_coordinates(state)
+        rows = pd.merge(
+            get_crop_index().select(State_Name=state), self.coordinates, on="District_Name", how="left"
+        )
+        unlocated = rows["lat"].isna() | rows["lon"].isna()
+        self.unlocated_districts = sorted(rows.loc[unlocated, "District_Name"].unique())
+        self.index = CropIndex(rows[~unlocated])
+        self._year_frames = {}
+        self._lock = threading.Lock()
+
+    # District totals of every year for a crop and season, computed in one pass the
+    # first time they are asked for and kept with the state
+    def year_frames(self, crop, season):
+        with self._lock:
+            frames = self._year_frames.get((crop, season))
+        if frames is None:
+            with timed("map.year_frames"):
+                frames = year_layer_data(self.index.select(Crop=crop, Season=season))
+            with self._lock:
+                self._year_frames[(crop, season)] = frames
+        return frames
+
+
+_lock = threading.Lock()
+_state_maps = {}
+
+
+# Returns the joined rows of a state, merged once per state per process and only
+# rebuilt when the crop data or the stored coordinates of the state change
+def get_state_map(state):
+    revision = (get_crop_data_version(), geocode_store.state_revision(state))
+    with _lock:
+        cached = _state_maps.get(state)
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+    state_map = StateMap(state)
+    # the fallback may have written manual rows, key the cache on the state after that
+    revision = (get_crop_data_version(), geocode_store.state_revision(state))
+    with _lock:
+        _state_maps[state] = (revision, state_map)
+    return state_map
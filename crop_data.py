@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+
+CROP_DATA_FILE = "crop_production.csv"
+CACHE_FOLDER = ".data_cache"
+
+# Rows drawn by the heaviest plots before they switch to a sample or density view
+PLOT_ROW_BUDGET = 2000
+
+CATEGORICAL_COLUMNS = ["State_Name", "District_Name", "Season", "Crop"]
+COLUMN_DTYPES = {
+    "Crop_Year": "int16",
+    "Area": "float64",
+    "Production": "float64",
+}
+
+_lock = threading.Lock()
+_frame = None
+_signature = None
+
+
+# Returns the location of a file inside the cache folder, creating the folder if needed
+def cache_path(file_name):
+    folder = os.path.join(os.getcwd(), CACHE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, file_name)
+
+
+# Cheap signature of the source csv. The content hash is only computed when the
+# mtime/size pair changes, so a plain `touch` or fresh checkout does not force a rebuild.
+def _file_stat(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Parses the csv into typed columns. Text columns become categoricals whose
+# categories keep the order of first appearance in the csv, which is the order the
+# pages have always shown in their selectboxes.
+def _parse_csv(path):
+    df = pd.read_csv(path)
+    for column in CATEGORICAL_COLUMNS:
+        values = df[column]
+        df[column] = pd.Categorical(values, categories=pd.unique(values.dropna()))
+    for column, dtype in COLUMN_DTYPES.items():
+        df[column] = pd.to_numeric(df[column], errors="coerce").astype(dtype)
+    return df
+
+
+def _read_meta(meta_file):
+    try:
+        with open(meta_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_file, meta):
+    write_atomically(meta_file, lambda path: _dump_json(path, meta))
+
+
+def _dump_json(path, value):
+    with open(path, "w") as f:
+        json.dump(value, f)
+
+
+# Writes a cache file by calling write with a temporary path next to it and moving
+# the result into place, so a crash mid-write never leaves a half written file
+# under the real name
+def write_atomically(path, write):
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(partial)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+# Loads the crop data from the parquet cache, rebuilding the cache from the csv
+# whenever the source file has changed.
+@timed("crop_data.load")
+def _load(source):
+    parquet_file = cache_path("crop_production.parquet")
+    meta_file = cache_path("crop_production.json")
+    stat = _file_stat(source)
+    meta = _read_meta(meta_file)
+
+    if meta is not None and os.path.isfile(parquet_file):
+        if meta["size"] == stat["size"] and meta["mtime_ns"] == stat["mtime_ns"]:
+            return pd.read_parquet(parquet_file), meta["sha256"]
+        # mtime changed, check whether the content actually did
+        sha256 = _file_hash(source)
+        if meta["sha256"] == sha256:
+            _write_meta(meta_file, {**stat, "sha256": sha256})
+            return pd.read_parquet(parquet_file), sha256
+    else:
+        sha256 = _file_hash(source)
+
+    df = _parse_csv(source)
+    try:
+        write_atomically(parquet_file, lambda path: df.to_parquet(path, index=False))
+        _write_meta(meta_file, {**stat, "sha256": sha256})
+    except OSError as e:
+        # a read only deployment can still serve the parsed frame from memory
+        print(f"Could not write the crop data cache: {e}")
+    return df, sha256
+
+
+# Returns the shared crop production frame. The csv is converted to parquet once,
+# loaded once per process and every caller gets a shallow copy of it: columns a page
+# adds or replaces stay in its copy, but the values are shared, so a caller that
+# wants to change values in place must take its own .copy() first.
+def get_crop_data():
+    global _frame, _signature
+    with _lock:
+        source = os.path.join(os.getcwd(), CROP_DATA_FILE)
+        stat = _file_stat(source)
+        if _frame is None or _signature is None or _signature[:2] != (stat["size"], stat["mtime_ns"]):
+            _frame, sha256 = _load(source)
+            _signature = (stat["size"], stat["mtime_ns"], sha256)
+        return _frame.copy(deep=False)
+
+
+# Content hash of the crop data currently loaded, used to key derived caches
+def get_crop_data_version():
+    get_crop_data()
+    return _signature[2]
+
+
+# Unique values of a column in the order they first appear in the csv
+def unique_values(df, column):
+    return df[column].unique().tolist()
+
+
+# Stratified random sample of at most about budget rows. Every group of the stratify
+# column keeps its share of the rows (at least one), so small states or seasons do
+# not drop out of the plot. The sample is seeded, so the same selection always gives
+# the same rows, and it keeps the original row order.
+def sample_rows(df, budget=PLOT_ROW_BUDGET, stratify=None, seed=0):
+    if len(df) <= budget:
+        return df
+    random_keys = np.random.default_rng(seed).random(len(df))
+    if stratify is None:
+        return df.iloc[np.sort(np.argsort(random_keys)[:budget])]
+
+    # missing values form a group of their own
+    codes = pd.factorize(df[stratify], use_na_sentinel=False)[0]
+    group_sizes = np.bincount(codes)
+    quotas = np.maximum(1, np.round(group_sizes * budget / len(df))).astype(int)
+    # rows sorted by group and randomly within it, so the first quota rows of
+    # every group are its sample
+    order = np.lexsort((random_keys, codes))
+    starts = np.concatenate(([0], np.cumsum(group_sizes)[:-1]))
+    sorted_codes = codes[order]
+    positions = np.arange(len(order)) - starts[sorted_codes]
+    return df.iloc[np.sort(order[positions < quotas[sorted_codes]])]
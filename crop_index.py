@@ -0,0 +1,105 @@
+import itertools
+import threading
+
+import numpy as np
+import pandas as pd
+
+from crop_data import get_crop_data, get_crop_data_version
+from instrumentation import timed
+
+# Key columns in the order they are nested in the index
+KEY_COLUMNS = ["State_Name", "District_Name", "Crop", "Season", "Crop_Year"]
+
+
+# The order that sorts the crop data by a set of key columns, with an offset table
+# that maps every combination of key values to the contiguous range of that order
+# holding its rows. Only the permutation is kept, not a sorted copy of the data.
+class _SortedView:
+    def __init__(self, df, columns):
+        codes = [_column_codes(df[column]) for column in columns]
+        # lexsort treats the last key as the primary one, and is stable, so the
+        # rows of every group keep the order of the data
+        self.order = np.lexsort(codes[::-1])
+        self.columns = columns
+
+        self.offsets = {}
+        if not len(self.order):
+            return
+        # a new group starts wherever any of the sorted key codes changes
+        sorted_codes = np.column_stack([code[self.order] for code in codes])
+        changes = np.flatnonzero((np.diff(sorted_codes, axis=0) != 0).any(axis=1)) + 1
+        starts = np.concatenate(([0], changes))
+        stops = np.concatenate((changes, [len(self.order)]))
+
+        keys = df[columns].take(self.order[starts])
+        self.offsets = {
+            tuple(key): (int(start), int(stop))
+            for key, start, stop in zip(keys.itertuples(index=False, name=None), starts, stops)
+        }
+
+    # Positions in the data of the rows with the given key values
+    def positions(self, key):
+        start, stop = self.offsets.get(key, (0, 0))
+        return self.order[start:stop]
+
+
+def _column_codes(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy()
+    return pd.factorize(values, sort=True)[0]
+
+
+# Multi key index over the crop data. Every filter on any subset of KEY_COLUMNS is
+# answered from contiguous ranges of the sort order for that subset, built on first
+# use, and only the matching rows are taken from the data.
+class CropIndex:
+    def __init__(self, df):
+        self.frame = df
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def _view(self, columns):
+        with self._lock:
+            view = self._views.get(columns)
+            if view is None:
+                with timed("crop_index.build_view"):
+                    view = _SortedView(self.frame, list(columns))
+                self._views[columns] = view
+            return view
+
+    # Rows matching every given column=value filter. A value can also be a list of
+    # accepted values, e.g. select(Crop="Rice", Season=["Kharif", "Rabi"]).
+    @timed("crop_index.select")
+    def select(self, **filters):
+        unknown = set(filters) - set(KEY_COLUMNS)
+        if unknown:
+            raise KeyError(f"Cannot index on {sorted(unknown)}, expected some of {KEY_COLUMNS}")
+        if not filters:
+            return self.frame
+
+        columns = tuple(column for column in KEY_COLUMNS if column in filters)
+        choices = [
+            filters[column] if isinstance(filters[column], (list, tuple, set)) else [filters[column]]
+            for column in columns
+        ]
+        view = self._view(columns)
+        positions = [view.positions(key) for key in itertools.product(*choices)]
+        positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.intp)
+        return self.frame.take(positions).reset_index(drop=True)
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+# Returns the process wide index, rebuilt whenever the crop data changes
+def get_crop_index():
+    global _index, _index_version
+    df = get_crop_data()
+    with _index_lock:
+        version = get_crop_data_version()
+        if _index is None or _index_version != version:
+            _index = CropIndex(df)
+            _index_version = version
+        return _index
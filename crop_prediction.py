@@ -0,0 +1,307 @@
+import hashlib
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from encoder_tables import EncoderTables, describe_unknown
+from instrumentation import timed
+from model_registry import registry
+
+MODEL_FILE = "model2.pkl"
+LABEL_ENCODERS_FILE = "label_encoders2.pkl"
+# Compiled lookup tables of the label encoders, rebuilt when the pickle changes
+ENCODER_TABLES_FILE = "label_encoders2.npz"
+
+# Columns the model was trained on, in training order
+FEATURE_COLUMNS = ["District_Name", "Season", "Crop", "Area"]
+ENCODED_COLUMNS = ["District_Name", "Season", "Crop"]
+PREDICTION_CACHE_SIZE = 4096
+
+# MSP values dictionary for revenue calculation
+msp_values = {
+    "Arecanut": None,
+    "Other Kharif pulses": None,
+    "Rice": 2300,
+    "Banana": None,
+    "Cashewnut": None,
+    "Coconut": None,
+    "Dry ginger": None,
+    "Sugarcane": 340,
+    "Sweet potato": None,
+    "Tapioca": None,
+    "Black pepper": None,
+    "Dry chillies": None,
+    "other oilseeds": None,
+    "Turmeric": None,
+    "Maize": 2225,
+    "Moong(Green Gram)": 8682,
+    "Urad": 7400,
+    "Arhar/Tur": 7550,
+    "Groundnut": 6783,
+    "Sunflower": 7280,
+    "Bajra": 2500,
+    "Castor seed": None,
+    "Cotton(lint)": 7121,
+    "Horse-gram": None,
+    "Jowar": 3371,
+    "Korra": None,
+    "Ragi": 4290,
+    "Tobacco": None,
+    "Gram": 5335,
+    "Wheat": 2125,
+    "Masoor": 6000,
+    "Sesamum": 7307,
+    "Linseed": None,
+    "Safflower": 5215,
+    "Onion": None,
+    "other misc. pulses": None,
+    "Samai": None,
+    "Small millets": None,
+    "Coriander": None,
+    "Potato": None,
+    "Other Rabi pulses": None,
+    "Soyabean": 4892,
+    "Beans & Mutter(Vegetable)": None,
+    "Bhindi": None,
+    "Brinjal": None,
+    "Citrus Fruit": None,
+    "Cucumber": None,
+    "Grapes": None,
+    "Mango": None,
+    "Orange": None,
+    "other fibres": None,
+    "Other Fresh Fruits": None,
+    "Other Vegetables": None,
+    "Papaya": None,
+    "Pome Fruit": None,
+    "Tomato": None,
+    "Rapeseed & Mustard": 5450,
+    "Mesta": None,
+    "Cowpea(Lobia)": None,
+    "Lemon": None,
+    "Pome Granet": None,
+    "Sapota": None,
+    "Cabbage": None,
+    "Peas (vegetable)": None,
+    "Niger seed": 6930,
+    "Bottle Gourd": None,
+    "Sannhamp": None,
+    "Varagu": None,
+    "Garlic": None,
+    "Ginger": None,
+    "Oilseeds total": None,
+    "Pulses total": None,
+    "Jute": 4450,
+    "Peas & beans (Pulses)": None,
+    "Blackgram": None,
+    "Paddy": 1868,
+    "Pineapple": None,
+    "Barley": 1600,
+    "Khesari": None,
+    "Guar seed": None,
+    "Moth": None,
+    "Other Cereals & Millets": None,
+    "Cond-spcs other": None,
+    "Turnip": None,
+    "Carrot": None,
+    "Redish": None,
+    "Arcanut (Processed)": None,
+    "Atcanut (Raw)": None,
+    "Cashewnut Processed": None,
+    "Cashewnut Raw": None,
+    "Cardamom": None,
+    "Rubber": None,
+    "Bitter Gourd": None,
+    "Drum Stick": None,
+    "Jack Fruit": None,
+    "Snak Guard": None,
+    "Pump Kin": None,
+    "Tea": None,
+    "Coffee": None,
+    "Cauliflower": None,
+    "Other Citrus Fruit": None,
+    "Water Melon": None,
+    "Total foodgrain": None,
+    "Kapas": None,
+    "Colocosia": None,
+    "Lentil": None,
+    "Bean": None,
+    "Jobster": None,
+    "Perilla": None,
+    "Rajmash Kholar": None,
+    "Ricebean (nagadal)": None,
+    "Ash Gourd": None,
+    "Beet Root": None,
+    "Lab-Lab": None,
+    "Ribed Guard": None,
+    "Yam": None,
+    "Apple": None,
+    "Peach": None,
+    "Pear": None,
+    "Plums": None,
+    "Litchi": None,
+    "Ber": None,
+    "Other Dry Fruit": None,
+    "Jute & mesta": None,
+}
+
+
+# Runs one prediction right after loading so the first user does not pay for any
+# lazy initialisation inside the model
+def _warm_up_model(model):
+    row = {column: [0] for column in ENCODED_COLUMNS}
+    row["Area"] = [1.0]
+    model.predict(pd.DataFrame(row, columns=FEATURE_COLUMNS))
+
+
+registry.register("label_encoders", LABEL_ENCODERS_FILE)
+registry.register("crop_model", MODEL_FILE, mmap_mode="r", warm_up=_warm_up_model)
+
+_warm_up_lock = threading.Lock()
+_warm_up_started = False
+_tables_lock = threading.Lock()
+_encoder_tables = None
+
+
+# Returns the model, loaded once per server process
+def load_model():
+    return registry.get("crop_model")
+
+
+# Returns the encoder lookup tables, read from ENCODER_TABLES_FILE when they were
+# compiled from the current label encoders pickle and otherwise compiled from it
+# and saved there
+def load_encoder_tables():
+    global _encoder_tables
+    with _tables_lock:
+        if _encoder_tables is None:
+            with open(LABEL_ENCODERS_FILE, "rb") as f:
+                source_sha256 = hashlib.sha256(f.read()).hexdigest()
+            tables = None
+            if os.path.isfile(ENCODER_TABLES_FILE):
+                try:
+                    tables = EncoderTables.load(ENCODER_TABLES_FILE)
+                except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                    print(f"Could not read the encoder tables: {e}")
+            if tables is None or tables.source_sha256 != source_sha256:
+                tables = EncoderTables.from_label_encoders(registry.get("label_encoders"), source_sha256)
+                try:
+                    tables.save(ENCODER_TABLES_FILE)
+                except OSError as e:
+                    print(f"Could not write the encoder tables: {e}")
+            _encoder_tables = tables
+        return _encoder_tables
+
+
+# Loads and warms up the model on a background thread, once per process, so it is
+# ready by the time someone opens the prediction page
+def start_background_warm_up():
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=_warm_up, name="model-warm-up", daemon=True).start()
+
+
+def _warm_up():
+    load_encoder_tables()
+    load_model()
+
+
+# Least recently used cache of model outputs keyed on the encoded feature tuple.
+# It lives at module level, so it is shared by every session in the server process.
+class PredictionCache:
+    def __init__(self, maxsize=PREDICTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the cached value for every key, None where there is none
+    def get_many(self, keys):
+        values = []
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                values.append(value)
+        return values
+
+    def put_many(self, items):
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+prediction_cache = PredictionCache()
+
+
+# Encodes the categorical feature columns of a whole frame at once. Returns the
+# encoded features and a boolean frame marking, per row, which of the
+# ENCODED_COLUMNS hold a value the model has not seen during training.
+@timed("prediction.encode")
+def encode_features(df):
+    return load_encoder_tables().encode(df[FEATURE_COLUMNS], ENCODED_COLUMNS)
+
+
+# Predicts production (kilotons) and MSP revenue for every row of a frame with the
+# FEATURE_COLUMNS. Rows already in the prediction cache are not predicted again and
+# the remaining distinct rows go through the model in a single call. Rows with a
+# district, season or crop the model has not seen get NaN, as do revenues of crops
+# without an MSP.
+@timed("prediction.batch")
+def predict_batch(df):
+    model = load_model()
+    encoded, unknown = encode_features(df)
+    known = ~unknown.any(axis=1)
+
+    production = np.full(len(df), np.nan)
+    known_rows = np.flatnonzero(known.to_numpy())
+    if len(known_rows):
+        keys = list(encoded.iloc[known_rows].itertuples(index=False, name=None))
+        values = prediction_cache.get_many(keys)
+        missing_keys = list(dict.fromkeys(key for key, value in zip(keys, values) if value is None))
+        if missing_keys:
+            with timed("prediction.model"):
+                predicted = model.predict(pd.DataFrame(missing_keys, columns=FEATURE_COLUMNS))
+            fresh = dict(zip(missing_keys, predicted))
+            prediction_cache.put_many(fresh)
+            values = [fresh[key] if value is None else value for key, value in zip(keys, values)]
+        production[known_rows] = values
+
+    msp = df["Crop"].astype(object).map(msp_values).astype(float).to_numpy()
+    result = df.copy()
+    result["Known"] = known.to_numpy()
+    result["Unknown_Columns"] = describe_unknown(unknown).to_numpy()
+    result["Predicted_Production"] = production
+    result["MSP"] = msp
+    result["Predicted_Revenue"] = msp * production * 10000
+    return result
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from crop_data import cache_path, get_crop_data, get_crop_data_version, write_atomically
+from instrumentation import timed
+
+ROLLUP_TABLES = [
+    "summary",
+    "correlation",
+    "state_counts",
+    "season_stats",
+    "yield_histograms",
+    "yield_kde",
+]
+MAX_HISTOGRAM_BINS = 100
+KDE_POINTS = 200
+
+_lock = threading.Lock()
+_rollups = None
+_rollups_version = None
+
+
+# Box plot statistics in the form matplotlib's Axes.bxp expects, with whiskers
+# at the furthest points within 1.5 IQR like seaborn's boxplot draws them
+def _box_stats(values):
+    values = np.sort(values[np.isfinite(values)])
+    if not len(values):
+        return None
+    q1, med, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    return {
+        "count": len(values),
+        "whislo": inside[0],
+        "q1": q1,
+        "med": med,
+        "q3": q3,
+        "whishi": inside[-1],
+    }
+
+
+# Gaussian kernel density with Scott's bandwidth, evaluated on a fixed grid
+def _kde(values, grid):
+    if len(values) < 2 or np.std(values) == 0:
+        return np.zeros_like(grid)
+    bandwidth = np.std(values, ddof=1) * len(values) ** (-1 / 5)
+    density = np.zeros_like(grid)
+    # evaluate in chunks so large crops do not build a huge distance matrix
+    for start in range(0, len(values), 4096):
+        chunk = values[start : start + 4096]
+        density += np.exp(-0.5 * ((grid[:, None] - chunk[None, :]) / bandwidth) ** 2).sum(axis=1)
+    return density / (len(values) * bandwidth * np.sqrt(2 * np.pi))
+
+
+@timed("rollups.build")
+def _build(df):
+    summary = df.describe()
+    summary.index.name = "statistic"
+    correlation = df.corr(numeric_only=True)
+    correlation.index.name = "column"
+
+    crop = df["Crop"].astype(str)
+    state_counts = (
+        pd.DataFrame({"Crop": crop, "State_Name": df["State_Name"].astype(str)})
+        .value_counts()
+        .rename("count")
+        .reset_index()
+    )
+
+    season_rows = []
+    for (crop_name, season), production in df.groupby(["Crop", "Season"], observed=True)["Production"]:
+        stats = _box_stats(production.to_numpy())
+        if stats is not None:
+            season_rows.append({"Crop": crop_name, "Season": season, **stats})
+    season_stats = pd.DataFrame(season_rows)
+
+    histogram_rows = []
+    kde_rows = []
+    crop_yield = (df["Production"] / df["Area"]).to_numpy()
+    for crop_name, positions in df.groupby("Crop", observed=True).indices.items():
+        values = crop_yield[positions]
+        values = values[np.isfinite(values)]
+        if not len(values):
+            continue
+        edges = np.histogram_bin_edges(values, bins="auto")
+        if len(edges) > MAX_HISTOGRAM_BINS + 1:
+            edges = np.histogram_bin_edges(values, bins=MAX_HISTOGRAM_BINS)
+        counts, edges = np.histogram(values, bins=edges)
+        histogram_rows.append(
+            pd.DataFrame({"Crop": crop_name, "bin_left": edges[:-1], "bin_right": edges[1:], "count": counts})
+        )
+        grid = np.linspace(edges[0], edges[-1], KDE_POINTS)
+        kde_rows.append(pd.DataFrame({"Crop": crop_name, "yield": grid, "density": _kde(values, grid)}))
+
+    return {
+        "summary": summary.reset_index(),
+        "correlation": correlation.reset_index(),
+        "state_counts": state_counts,
+        "season_stats": season_stats,
+        "yield_histograms": pd.concat(histogram_rows, ignore_index=True),
+        "yield_kde": pd.concat(kde_rows, ignore_index=True),
+    }
+
+
+@timed("rollups.load")
+def _load(version):
+    meta_file = cache_path("rollups.json")
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta["version"] == version:
+            return {name: pd.read_parquet(cache_path(f"rollup_{name}.parquet")) for name in ROLLUP_TABLES}
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+# Every file is replaced atomically. The version file goes first, so a reader never
+# pairs the old version with new tables, and is only written back after all tables.
+def _save(rollups, version):
+    meta_file = cache_path("rollups.json")
+    try:
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        for name, table in rollups.items():
+            write_atomically(
+                cache_path(f"rollup_{name}.parquet"), lambda path, table=table: table.to_parquet(path, index=False)
+            )
+        write_atomically(meta_file, lambda path: _dump_version(path, version))
+    except OSError as e:
+        print(f"Could not write the rollup cache: {e}")
+
+
+def _dump_version(path, version):
+    with open(path, "w") as f:
+        json.dump({"version": version}, f)
+
+
+# Pre-aggregated tables for the EDA page. They are built from the crop data on first
+# use, written next to the parquet cache and reloaded from disk until the csv changes.
+class CropRollups:
+    def __init__(self, tables):
+        self.tables = tables
+
+    def summary(self):
+        return self.tables["summary"].set_index("statistic")
+
+    def correlation(self):
+        return self.tables["correlation"].set_index("column")
+
+    # The per crop tables below hold every crop when no crop is given
+    def state_counts(self, crop=None):
+        counts = self.tables["state_counts"]
+        if crop is not None:
+            counts = counts[counts["Crop"] == crop]
+        return counts.sort_values("count", ascending=False)
+
+    def season_stats(self, crop=None, seasons=None):
+        stats = self.tables["season_stats"]
+        if crop is not None:
+            stats = stats[stats["Crop"] == crop]
+        if seasons is not None:
+            stats = stats[stats["Season"].isin(seasons)]
+        return stats
+
+    def yield_histogram(self, crop=None):
+        histograms = self.tables["yield_histograms"]
+        if crop is None:
+            return histograms
+        return histograms[histograms["Crop"] == crop]
+
+    def yield_kde(self, crop=None):
+        kde = self.tables["yield_kde"]
+        if crop is None:
+            return kde
+        return kde[kde["Crop"] == crop]
+
+
+def get_crop_rollups():
+    global _rollups, _rollups_version
+    with _lock:
+        version = get_crop_data_version()
+        if _rollups is None or _rollups_version != version:
+            tables = _load(version)
+            if tables is None:
+                tables = _build(get_crop_data())
+                _save(tables, version)
+            _rollups = CropRollups(tables)
+            _rollups_version = version
+        return _rollups
+
+
+if __name__ == "__main__":
+    # Builds the rollup cube ahead of time, e.g. as a deployment step
+    get_crop_rollups()
+    print(f"Rollups written to {cache_path('rollups.json')}")
@@ -0,0 +1,151 @@
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+
+# Cells per axis of the Production vs Area density view
+DENSITY_BINS = 40
+# Decimals kept in the yield tables sent to the browser
+YIELD_DECIMALS = 3
+
+
+@timed("eda.correlation_chart")
+def correlation_chart(correlation):
+    cells = correlation.rename_axis("row").reset_index().melt("row", var_name="column", value_name="correlation")
+    base = alt.Chart(cells).encode(
+        x=alt.X("column:N", title=None, sort=list(correlation.columns)),
+        y=alt.Y("row:N", title=None, sort=list(correlation.index)),
+    )
+    heatmap = base.mark_rect().encode(
+        color=alt.Color("correlation:Q", scale=alt.Scale(scheme="redblue", domain=[-1, 1], reverse=True)),
+        tooltip=["row", "column", alt.Tooltip("correlation:Q", format=".2f")],
+    )
+    labels = base.mark_text().encode(text=alt.Text("correlation:Q", format=".2f"))
+    return (heatmap + labels).properties(height=300)
+
+
+# Number of rows per state of one crop
+@timed("eda.state_count_chart")
+def state_count_chart(state_counts, crop):
+    return (
+        alt.Chart(state_counts[["State_Name", "count"]], title=f"Distribution of {crop} across States")
+        .mark_bar()
+        .encode(
+            x=alt.X("State_Name:N", title="States", sort="-y", axis=alt.Axis(labelAngle=-45)),
+            y=alt.Y("count:Q", title="Count"),
+            tooltip=["State_Name", "count"],
+        )
+    )
+
+
+# Box plots of one crop drawn from the precomputed quartiles and whiskers of every season
+@timed("eda.season_box_chart")
+def season_box_chart(season_stats, crop):
+    base = alt.Chart(season_stats.drop(columns="Crop")).encode(
+        x=alt.X("Season:N", title="Season"),
+        tooltip=[
+            "Season",
+            "count",
+            alt.Tooltip("whislo:Q", title="lower whisker", format=",.1f"),
+            alt.Tooltip("q1:Q", format=",.1f"),
+            alt.Tooltip("med:Q", title="median", format=",.1f"),
+            alt.Tooltip("q3:Q", format=",.1f"),
+            alt.Tooltip("whishi:Q", title="upper whisker", format=",.1f"),
+        ],
+    )
+    whiskers = base.mark_rule().encode(y=alt.Y("whislo:Q", title="Production"), y2="whishi:Q")
+    boxes = base.mark_bar(size=40).encode(y="q1:Q", y2="q3:Q")
+    medians = base.mark_tick(color="white", size=40, thickness=2).encode(y="med:Q")
+    return alt.layer(whiskers, boxes, medians, title=f"Production by Season for {crop}")
+
+
+# Yield histogram of one crop with its density curve scaled to the histogram counts,
+# the way seaborn's histplot draws it
+@timed("eda.yield_chart")
+def yield_chart(histogram, kde, crop):
+    total = histogram["count"].sum()
+    bin_width = (histogram["bin_right"] - histogram["bin_left"]).iloc[0] if len(histogram) else 0
+    kde = pd.DataFrame({"yield": kde["yield"], "count": kde["density"] * total * bin_width})
+    histogram = histogram.round({"bin_left": YIELD_DECIMALS, "bin_right": YIELD_DECIMALS})
+    kde = kde.round({"yield": YIELD_DECIMALS, "count": 1})
+
+    bars = (
+        alt.Chart(histogram[["bin_left", "bin_right", "count"]])
+        .mark_bar(opacity=0.75)
+        .encode(
+            x=alt.X("bin_left:Q", title="Yield (Production per unit area)"),
+            x2="bin_right:Q",
+            y=alt.Y("count:Q", title="Count"),
+            tooltip=[
+                alt.Tooltip("bin_left:Q", title="from", format=",.2f"),
+                alt.Tooltip("bin_right:Q", title="to", format=",.2f"),
+                "count",
+            ],
+        )
+    )
+    curve = alt.Chart(kde).mark_line().encode(x="yield:Q", y="count:Q")
+    return alt.layer(bars, curve, title=f"Yield Distribution for {crop}")
+
+
+# Production vs Area points coloured by season. Clicking a season in the legend
+# highlights it in the browser.
+@timed("eda.scatter_chart")
+def scatter_chart(rows, seasons, title):
+    points = rows[["State_Name", "District_Name", "Crop_Year", "Season", "Area", "Production"]].astype(
+        {"State_Name": str, "District_Name": str, "Season": str}
+    )
+    season = alt.selection_point(fields=["Season"], bind="legend")
+    return (
+        alt.Chart(points, title=title)
+        .mark_circle()
+        .encode(
+            x="Area:Q",
+            y="Production:Q",
+            color=alt.Color("Season:N", scale=alt.Scale(domain=[str(value) for value in seasons])),
+            opacity=alt.condition(season, alt.value(0.8), alt.value(0.1)),
+            tooltip=["State_Name", "District_Name", "Crop_Year", "Season", "Area", "Production"],
+        )
+        .add_params(season)
+        .interactive()
+    )
+
+
+# Production vs Area of any number of rows as a DENSITY_BINS x DENSITY_BINS grid of
+# row counts, binned on the server so only the non-empty cells are sent
+@timed("eda.density_table")
+def density_table(rows, bins=DENSITY_BINS):
+    values = rows[["Area", "Production"]].dropna()
+    counts, area_edges, production_edges = np.histogram2d(values["Area"], values["Production"], bins=bins)
+    area_index, production_index = np.nonzero(counts)
+    return pd.DataFrame(
+        {
+            "area_left": area_edges[area_index],
+            "area_right": area_edges[area_index + 1],
+            "production_left": production_edges[production_index],
+            "production_right": production_edges[production_index + 1],
+            "rows": counts[area_index, production_index].astype(int),
+        }
+    )
+
+
+@timed("eda.density_chart")
+def density_chart(cells, title):
+    return (
+        alt.Chart(cells, title=title)
+        .mark_rect()
+        .encode(
+            x=alt.X("area_left:Q", title="Area"),
+            x2="area_right:Q",
+            y=alt.Y("production_left:Q", title="Production"),
+            y2="production_right:Q",
+            color=alt.Color("rows:Q", title="Rows", scale=alt.Scale(type="log", scheme="viridis")),
+            tooltip=[
+                alt.Tooltip("area_left:Q", title="Area from", format=",.0f"),
+                alt.Tooltip("area_right:Q", title="Area to", format=",.0f"),
+                alt.Tooltip("production_left:Q", title="Production from", format=",.0f"),
+                alt.Tooltip("production_right:Q", title="Production to", format=",.0f"),
+                "rows",
+            ],
+        )
+    )
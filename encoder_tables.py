@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from crop_data import write_atomically
+
+# Key of the saved tables that holds the sha256 of the pickle they were compiled from
+SOURCE_HASH_KEY = "__source_sha256__"
+
+
+# Category to code lookup tables compiled from fitted sklearn LabelEncoders. The
+# sorted classes of every column are kept as fixed width string arrays, so a whole
+# column is encoded with one np.searchsorted call, and the tables can be saved to
+# an .npz file that loads without unpickling sklearn objects. The file also records
+# the sha256 of the pickle the tables came from, so a stale file can be told apart.
+class EncoderTables:
+    def __init__(self, classes, source_sha256=None):
+        self.classes = {column: np.asarray(values, dtype=str) for column, values in classes.items()}
+        self.columns = list(self.classes)
+        self.source_sha256 = source_sha256
+
+    @classmethod
+    def from_label_encoders(cls, label_encoders, source_sha256=None):
+        return cls({column: encoder.classes_ for column, encoder in label_encoders.items()}, source_sha256)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as tables:
+            classes = {column: tables[column] for column in tables.files if column != SOURCE_HASH_KEY}
+            source_sha256 = str(tables[SOURCE_HASH_KEY]) if SOURCE_HASH_KEY in tables.files else None
+        return cls(classes, source_sha256)
+
+    # Replaces the file atomically, so a reader never opens a half written archive
+    def save(self, path):
+        write_atomically(path, self._write)
+
+    def _write(self, path):
+        # through a file object, np.savez would add .npz to the temporary name
+        with open(path, "wb") as f:
+            np.savez(f, **self.classes, **{SOURCE_HASH_KEY: np.asarray(self.source_sha256 or "")})
+
+    # Encodes the given columns of a frame. Returns the frame with those columns
+    # replaced by their codes and a boolean frame marking, per row and column, the
+    # values that are not in the tables. Unknown values are encoded as -1.
+    def encode(self, df, columns=None):
+        columns = self.columns if columns is None else columns
+        encoded = df.copy()
+        unknown = pd.DataFrame(index=df.index)
+        for column in columns:
+            classes = self.classes[column]
+            values = df[column].astype(str).to_numpy().astype(str)
+            if not len(classes):
+                encoded[column] = np.full(len(df), -1, dtype=np.int64)
+                unknown[column] = True
+                continue
+            positions = np.searchsorted(classes, values)
+            in_range = np.minimum(positions, len(classes) - 1)
+            found = (positions < len(classes)) & (classes[in_range] == values)
+            encoded[column] = np.where(found, positions, -1).astype(np.int64)
+            unknown[column] = ~found
+        return encoded, unknown
+
+
+# Comma separated names of the unknown columns of every row, "" where all are known
+def describe_unknown(unknown):
+    labels = pd.Series("", index=unknown.index)
+    for column in unknown.columns:
+        labels = labels.where(~unknown[column], labels + column + ", ")
+    return labels.str.removesuffix(", ")
@@ -0,0 +1,77 @@
+import io
+import threading
+from collections import OrderedDict
+
+from instrumentation import timed
+from lazy_imports import lazy_import
+
+# pyplot is only imported once a figure is actually drawn
+plt = lazy_import("matplotlib.pyplot")
+
+FIGURE_CACHE_SIZE = 64
+FIGURE_FORMAT = "png"
+FIGURE_DPI = 200
+
+
+# Least recently used cache of rendered figures, keyed on (plot type, selection).
+# Figures are drawn once, saved as PNG bytes and closed right away, so reruns that
+# do not change a plot neither redraw it nor keep matplotlib figures alive. It lives
+# at module level and is shared by every session in the server process.
+class FigureCache:
+    def __init__(self, maxsize=FIGURE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the image bytes for key, calling draw() to build the figure when the
+    # key is not cached. draw returns a matplotlib Figure (or anything with a
+    # .figure, like a seaborn PairGrid).
+    def render(self, key, draw):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        with timed(f"figure.{key[0]}"):
+            image = _to_bytes(draw())
+        with self._lock:
+            self._entries[key] = image
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return image
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "bytes": sum(len(image) for image in self._entries.values()),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Saves a figure the way st.pyplot does and closes it
+def _to_bytes(fig):
+    fig = getattr(fig, "figure", fig)
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format=FIGURE_FORMAT, dpi=FIGURE_DPI, bbox_inches="tight")
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
+
+
+figure_cache = FigureCache()
@@ -0,0 +1,268 @@
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime, timezone
+
+import pandas as pd
+
+STATE_FOLDER = "State Files"
+GEOCODE_DB_FILE = os.path.join(STATE_FOLDER, "geocodes.sqlite3")
+# District coordinates for every state, built ahead of time and shipped with the app
+DISTRICT_COORDINATES_FILE = "district_coordinates.csv"
+
+# How a row got its coordinates
+HIT = "hit"          # found by the geocoding API
+MISS = "miss"        # the API had no (usable) match, coordinates are NULL
+MANUAL = "manual"    # filled in from the hardcoded fallback coordinates
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocodes (
+    state TEXT NOT NULL,
+    district TEXT NOT NULL,
+    lat REAL,
+    lon REAL,
+    status TEXT NOT NULL CHECK (status IN ('hit', 'miss', 'manual')),
+    updated_at TEXT NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 0,
+    -- 'packaged' for rows of the packaged table, 'local' for rows of this install
+    source TEXT NOT NULL DEFAULT 'local',
+    PRIMARY KEY (state, district)
+)
+"""
+# Bookkeeping values: the hash of the packaged table that was imported last and the
+# revision counter, bumped by every write and stored with the rows it wrote
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+"""
+
+
+_setup_lock = threading.Lock()
+# Database this process has already set up, later connections only open it
+_set_up_for = None
+
+
+def _connect():
+    global _set_up_for
+    os.makedirs(STATE_FOLDER, exist_ok=True)
+    with _setup_lock:
+        first_use = not os.path.isfile(GEOCODE_DB_FILE)
+        connection = sqlite3.connect(GEOCODE_DB_FILE, timeout=30)
+        database = os.path.abspath(GEOCODE_DB_FILE)
+        if first_use or _set_up_for != database:
+            try:
+                _set_up(connection, first_use)
+            except Exception:
+                connection.close()
+                raise
+            _set_up_for = database
+    return connection
+
+
+# Schema, migrations and the packaged table, once per process and database
+def _set_up(connection, first_use):
+    # WAL is stored in the database file, it does not need setting per connection
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(_SCHEMA)
+    connection.execute(_META_SCHEMA)
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(geocodes)")}
+    if "revision" not in columns:
+        # databases created before rows carried their revision
+        with connection:
+            connection.execute("ALTER TABLE geocodes ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+    if "source" not in columns:
+        # databases created before rows carried their source. Their packaged rows
+        # may have been overwritten by misses, so the packaged table is imported again.
+        with connection:
+            connection.execute("ALTER TABLE geocodes ADD COLUMN source TEXT NOT NULL DEFAULT 'local'")
+            connection.execute("UPDATE geocodes SET source = 'packaged' WHERE updated_at = 'packaged'")
+            connection.execute("DELETE FROM meta WHERE key = 'packaged_sha256'")
+    # the old state files go first, so the packaged table fills what they lack
+    if first_use:
+        _import_state_files(connection)
+    _sync_packaged_coordinates(connection)
+
+
+# Imports the packaged coordinate table whenever its content differs from the one
+# imported last, e.g. after a new --build was deployed
+def _sync_packaged_coordinates(connection):
+    if not os.path.isfile(DISTRICT_COORDINATES_FILE):
+        return
+    with open(DISTRICT_COORDINATES_FILE, "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    imported = connection.execute("SELECT value FROM meta WHERE key = 'packaged_sha256'").fetchone()
+    if imported is None or imported[0] != sha256:
+        _import_packaged_coordinates(connection)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('packaged_sha256', ?)", (sha256,))
+
+
+# Copies the packaged coordinate table into the database. A packaged row replaces
+# earlier packaged rows, fallback (manual) rows and misses, so a new --build corrects
+# them. Hits this install got from the API are kept, and a located row is never
+# replaced by a packaged miss.
+def _import_packaged_coordinates(connection):
+    packaged = pd.read_csv(DISTRICT_COORDINATES_FILE)
+    updated_at = datetime.now(timezone.utc).isoformat()
+    with connection:
+        revision = _next_revision(connection)
+        connection.executemany(
+            "INSERT INTO geocodes (state, district, lat, lon, status, updated_at, revision, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 'packaged') "
+            "ON CONFLICT (state, district) DO UPDATE SET "
+            "lat = excluded.lat, lon = excluded.lon, status = excluded.status, "
+            "updated_at = excluded.updated_at, revision = excluded.revision, source = excluded.source "
+            "WHERE (geocodes.source = 'packaged' OR geocodes.status != 'hit') "
+            "AND NOT (excluded.status = 'miss' AND geocodes.lat IS NOT NULL)",
+            [
+                (
+                    row.State_Name, row.District_Name, _to_float(row.lat), _to_float(row.lon), row.status,
+                    updated_at, revision,
+                )
+                for row in packaged.itertuples(index=False)
+            ],
+        )
+
+
+# Moves coordinates from the old per state `lat_lon_<state>.csv` files into the database
+def _import_state_files(connection):
+    # imported here because lat_long_finder itself writes through this module
+    from lat_long_finder import INDIAN_STATE_LIST
+
+    for lat_lon_file in glob.glob(os.path.join(STATE_FOLDER, "lat_lon_*.csv")):
+        state = os.path.basename(lat_lon_file)[len("lat_lon_") : -len(".csv")].replace("_", " ")
+        # the file names lost trailing spaces, so match them back to the state list
+        state = next((name for name in INDIAN_STATE_LIST if " ".join(name.split()) == state), state)
+        lat_lon_df = pd.read_csv(lat_lon_file)
+        rows = [
+            (district, lat, lon, MISS if pd.isna(lat) or pd.isna(lon) else HIT)
+            for district, lat, lon in lat_lon_df[["District_Name", "lat", "lon"]].itertuples(index=False)
+        ]
+        _save(connection, state, rows, keep_located=True)
+
+
+# Stores rows of this install. With keep_located a miss never replaces a stored
+# row that has coordinates.
+def _save(connection, state, rows, keep_located=False):
+    updated_at = datetime.now(timezone.utc).isoformat()
+    keep = " WHERE NOT (excluded.status = 'miss' AND geocodes.lat IS NOT NULL)" if keep_located else ""
+    with connection:
+        revision = _next_revision(connection)
+        connection.executemany(
+            "INSERT INTO geocodes (state, district, lat, lon, status, updated_at, revision, source) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 'local') "
+            "ON CONFLICT (state, district) DO UPDATE SET "
+            "lat = excluded.lat, lon = excluded.lon, status = excluded.status, "
+            "updated_at = excluded.updated_at, revision = excluded.revision, source = excluded.source" + keep,
+            [
+                (state, district, _to_float(lat), _to_float(lon), status, updated_at, revision)
+                for district, lat, lon, status in rows
+            ],
+        )
+
+
+# Bumps the revision counter inside the caller's transaction and returns the new
+# value. The write lock taken by the bump keeps revisions increasing across processes.
+def _next_revision(connection):
+    connection.execute(
+        "INSERT INTO meta (key, value) VALUES ('revision', 1) "
+        "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+    )
+    return int(connection.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0])
+
+
+def _to_float(value):
+    return None if pd.isna(value) else float(value)
+
+
+# Stores (district, lat, lon, status) rows for a state, replacing earlier results
+def save_coordinates(state, rows):
+    with closing(_connect()) as connection:
+        _save(connection, state, rows)
+
+
+# Coordinates of every stored district of a state, in one indexed query
+def get_state_coordinates(state):
+    with closing(_connect()) as connection:
+        return pd.read_sql_query(
+            "SELECT district AS District_Name, lat, lon, status FROM geocodes WHERE state = ?",
+            connection,
+            params=(state,),
+        )
+
+
+# Revision of the stored coordinates of the state (or of any state), which grows
+# whenever coordinates are added or updated
+def state_revision(state=None):
+    query = "SELECT COALESCE(MAX(revision), 0) FROM geocodes"
+    params = ()
+    if state is not None:
+        query += " WHERE state = ?"
+        params = (state,)
+    with closing(_connect()) as connection:
+        return connection.execute(query, params).fetchone()[0]
+
+
+# Located districts of every state in one query
+def get_all_coordinates():
+    with closing(_connect()) as connection:
+        return pd.read_sql_query(
+            "SELECT state AS State_Name, district AS District_Name, lat, lon, status FROM geocodes "
+            "WHERE lat IS NOT NULL AND lon IS NOT NULL",
+            connection,
+        )
+
+
+# Writes every stored coordinate to the packaged table shipped with the app
+def export_district_coordinates(path=DISTRICT_COORDINATES_FILE):
+    with closing(_connect()) as connection:
+        coordinates = pd.read_sql_query(
+            "SELECT state AS State_Name, district AS District_Name, lat, lon, status "
+            "FROM geocodes ORDER BY state, district",
+            connection,
+        )
+    coordinates.to_csv(path, index=False)
+    return len(coordinates)
+
+
+# Districts that still need geocoding: never looked up, or not found last time when
+# retry_misses is set or the miss is older than retry_misses_after seconds
+def pending_districts(state, districts, retry_misses=False, retry_misses_after=None):
+    with closing(_connect()) as connection:
+        stored = connection.execute(
+            "SELECT district, status, updated_at FROM geocodes WHERE state = ?", (state,)
+        ).fetchall()
+    now = datetime.now(timezone.utc)
+    done = set()
+    for district, status, updated_at in stored:
+        if status == MISS and (retry_misses or _older_than(updated_at, retry_misses_after, now)):
+            continue
+        done.add(district)
+    return [district for district in districts if district not in done]
+
+
+# Whether a stored updated_at lies more than seconds before now. Rows without a
+# parseable time, e.g. packaged rows of older databases, count as old.
+def _older_than(updated_at, seconds, now):
+    if seconds is None:
+        return False
+    try:
+        return (now - datetime.fromisoformat(updated_at)).total_seconds() > seconds
+    except ValueError:
+        return True
+
+
+# Number of stored districts per status, over all states or a single one
+def status_counts(state=None):
+    query = "SELECT status, COUNT(*) FROM geocodes"
+    params = ()
+    if state is not None:
+        query += " WHERE state = ?"
+        params = (state,)
+    with closing(_connect()) as connection:
+        return dict(connection.execute(query + " GROUP BY status", params).fetchall())
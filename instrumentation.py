@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Durations kept per stage for the percentiles, the oldest are dropped first
+STAGE_SAMPLES = 1000
+# Set to 1 to show the debug panel on every page, or open a page with ?debug=1
+DEBUG_ENV_VAR = "CROP_APP_DEBUG"
+
+
+class _Stage:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.samples = deque(maxlen=STAGE_SAMPLES)
+
+
+# Collects how long every named stage took, across all sessions of the server
+# process (or the whole run of a script)
+class StageTimings:
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+
+    def record(self, stage, seconds, failed=False):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = _Stage()
+            stats.count += 1
+            stats.errors += int(failed)
+            stats.total_seconds += seconds
+            stats.samples.append(seconds)
+
+    # One row per stage with its count and latency percentiles in milliseconds,
+    # slowest total first
+    def summary(self):
+        with self._lock:
+            stages = [
+                (name, stats.count, stats.errors, stats.total_seconds, list(stats.samples))
+                for name, stats in self._stages.items()
+            ]
+        rows = []
+        for name, count, errors, total_seconds, samples in stages:
+            p50, p95 = np.percentile(samples, [50, 95]) * 1000
+            rows.append(
+                {
+                    "stage": name,
+                    "count": count,
+                    "errors": errors,
+                    "total_ms": round(total_seconds * 1000, 1),
+                    "p50_ms": round(float(p50), 1),
+                    "p95_ms": round(float(p95), 1),
+                    "max_ms": round(max(samples) * 1000, 1),
+                }
+            )
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    # The summary as JSON, written to path when one is given
+    def export_json(self, path=None):
+        report = {
+            "started_at": self.started_at.isoformat(),
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+            "stages": self.summary(),
+        }
+        text = json.dumps(report, indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self.started_at = datetime.now(timezone.utc)
+
+
+stage_timings = StageTimings()
+
+
+# Times a stage. Works as `with timed("stage"):` and as a `@timed("stage")` decorator.
+# Stages that raise are still recorded and counted as errors, except for the
+# st.stop() and st.rerun() control flow, which does not derive from Exception.
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        stage_timings.record(stage, time.perf_counter() - start, failed)
+
+
+# Prints the stage timings as a table, for the command line scripts
+def print_summary():
+    rows = stage_timings.summary()
+    if not rows:
+        return
+    print(f"\n{'Stage':<32}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'total ms':>12}")
+    for row in rows:
+        print(f"{row['stage']:<32}{row['count']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['total_ms']:>12}")
+
+
+def debug_enabled():
+    import streamlit as st
+
+    return os.environ.get(DEBUG_ENV_VAR) == "1" or st.query_params.get("debug") == "1"
+
+
+# Sidebar expander with the stage timings of the server process so far, the lazy
+# import times and a JSON download. Only shown in debug mode. Pages call it right
+# after set_page_config, so it shows up even on pages that end with st.stop().
+def debug_panel():
+    import streamlit as st
+    from lazy_imports import import_report
+
+    if not debug_enabled():
+        return
+    with st.sidebar.expander("🛠️ Debug: timings"):
+        st.caption(f"Collected since {stage_timings.started_at:%Y-%m-%d %H:%M:%S} UTC")
+        rows = stage_timings.summary()
+        if rows:
+            st.dataframe(rows, use_container_width=True)
+        else:
+            st.write("No stages recorded yet.")
+        imports = import_report()
+        if imports:
+            st.write("**Lazy imports**")
+            st.dataframe(
+                [{"module": name, "import_ms": round(seconds * 1000, 1)} for name, seconds in imports],
+                use_container_width=True,
+            )
+        st.download_button(
+            "Download timings (JSON)",
+            stage_timings.export_json(),
+            file_name="stage_timings.json",
+            mime="application/json",
+        )
+        if st.button("Reset timings"):
+            stage_timings.reset()
+            st.rerun()
@@ -1,10 +1,16 @@
 import pandas as pd
 import requests
-import json
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
+from crop_index import get_crop_index
+from instrumentation import print_summary, timed
+import geocode_store
 
 INDIAN_STATE_LIST = ['Andaman and Nicobar Islands', 'Andhra Pradesh', 'Arunachal Pradesh',
  'Assam', 'Bihar', 'Chandigarh', 'Chhattisgarh', 'Dadra and Nagar Haveli',
@@ -14,54 +20,201 @@ INDIAN_STATE_LIST = ['Andaman and Nicobar Islands', 'Andhra Pradesh', 'Arunachal
  'Rajasthan', 'Sikkim', 'Tamil Nadu', 'Telangana ', 'Tripura', 'Uttar Pradesh',
  'Uttarakhand', 'West Bengal']
 
-# Generates a csv file containing the district name, latitude and longitude for a given state. 
-# Districts in the crop_production.csv are used only
-def generate_lat_lon_csv(state):
+# The API url can be pointed at a local stub server through the GEO_API_URL environment variable
+GEO_API_URL = "http://api.weatherapi.com/v1/current.json"
+GEO_CONCURRENCY = 8      # requests in flight at the same time
+GEO_RATE_LIMIT = 10      # requests started per second
+GEO_MAX_RETRIES = 3
+GEO_BACKOFF_SECONDS = 0.5
+GEO_TIMEOUT_SECONDS = 10
+# Districts the API could not find are looked up again by the background refresh
+# once their miss is this old
+GEO_RETRY_MISSES_AFTER_SECONDS = 7 * 24 * 3600
+# A state is refreshed in the background at most once per this many seconds
+GEO_REFRESH_INTERVAL_SECONDS = 3600
+
+
+# Spaces out requests shared by all worker threads so at most `rate` start per second
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class RetryableResponse(Exception):
+    pass
+
+
+# Looks up the coordinates of one district. Network errors, rate limiting (429) and
+# server errors are retried with exponential backoff, everything else is final.
+# Returns [district, lat, lon] with NaN coordinates when no match was found.
+def geocode_district(session, rate_limiter, api_url, api_key, district, state):
+    params = {"key": api_key, "q": f"{district} {state}", "aqi": "no"}
+    for attempt in range(GEO_MAX_RETRIES + 1):
+        rate_limiter.wait()
+        try:
+            with timed("geocode.request"):
+                response = session.get(api_url, params=params, timeout=GEO_TIMEOUT_SECONDS)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RetryableResponse(f"HTTP {response.status_code}")
+            response = response.json()
+            break
+        except (requests.RequestException, ValueError, RetryableResponse) as e:
+            if attempt == GEO_MAX_RETRIES:
+                print(f"\nCoordinates for {district} could not be fetched ({e})! Enter coordinates manually.")
+                return [district, np.nan, np.nan]
+            time.sleep(GEO_BACKOFF_SECONDS * 2 ** attempt)
+
+    if 'error' in response or 'location' not in response :
+        print(f"\nCoordinates for {district} could not be found! Enter coordinates manually.")
+        return [district, np.nan, np.nan]
+    elif response["location"]["country"] != "India" or state not in response["location"]["region"]:
+        print(f"\nCoordinates for {district} were not found in the region you were looking for! Enter coordinates manually.")
+        return [district, np.nan, np.nan]
+
+    return [district, response["location"]["lat"], response["location"]["lon"]]
+
+
+# Geocodes all districts of a state on a thread pool sharing one HTTP session and
+# one rate limiter, and builds the result frame in one go at the end. on_result is
+# called on the calling thread with every [district, lat, lon] row as it completes.
+def geocode_districts(
+    districts, state, api_key, api_url=None, concurrency=GEO_CONCURRENCY, rate_limit=GEO_RATE_LIMIT,
+    on_result=None,
+):
+    api_url = api_url or os.environ.get("GEO_API_URL", GEO_API_URL)
+    rate_limiter = RateLimiter(rate_limit)
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(geocode_district, session, rate_limiter, api_url, api_key, district, state)
+                for district in districts
+            ]
+            for future in as_completed(futures):
+                if on_result is not None:
+                    on_result(future.result())
+            rows = [future.result() for future in futures]
+    return pd.DataFrame(rows, columns=["District_Name", "lat", "lon"])
+
+# Geocodes the districts of a state and stores them in the geocode database.
+# Districts in the crop_production.csv are used only, and districts already in the
+# database are skipped, so a run that fails midway resumes where it stopped. Misses
+# are looked up again with retry_misses, or once older than retry_misses_after seconds.
+@timed("geocode.state")
+def fill_state_coordinates(
+    state, retry_misses=False, retry_misses_after=None, concurrency=GEO_CONCURRENCY, rate_limit=GEO_RATE_LIMIT,
+):
     # check if the input state to this method is valid
     assert state in INDIAN_STATE_LIST, f"'{state}' is not a valid state."
-    # determine the file path to store the csv file for latitute and longitude
-    lat_lon_file = os.path.join(os.getcwd(), f"State Files/lat_lon_{'_'.join(word for word in state.split())}.csv")
-    # if the lat lon file already exists we can directly exit the function else continue to generate it
-    if os.path.isfile(lat_lon_file):
+    df = get_crop_index().select(State_Name=state)
+    # find out names of all unique districts from the dataframe for that state
+    districts = geocode_store.pending_districts(
+        state, df["District_Name"].unique().tolist(), retry_misses, retry_misses_after
+    )
+    # if every district is already stored we can directly exit the function
+    if not districts:
         return
+    print(districts)
     # load the environment variable from the .env file. Remember api_keys are like passwords that's why 
     # we store them as environment variables.
     load_dotenv()
     api_key = os.environ.get("GEO_API_KEY")
-    df = pd.read_csv("crop_production.csv")
-    df = df[df["State_Name"]==state]
-    # find out names of all unique districts from the dataframe for that state
-    print(df["District_Name"].unique())
-    lat_lon_df = pd.DataFrame(columns=["District_Name", "lat", "lon"])
+    if not api_key:
+        # without a key every lookup would fail and be stored as a miss
+        print(f"GEO_API_KEY is not set, cannot geocode the districts of {state}.")
+        return
+
+    # Make API calls to get all latitutes and longitudes, saving every result as soon as it arrives
+    def save(row):
+        district, lat, lon = row
+        status = geocode_store.MISS if pd.isna(lat) or pd.isna(lon) else geocode_store.HIT
+        geocode_store.save_coordinates(state, [(district, lat, lon, status)])
+
+    geocode_districts(districts, state, api_key, concurrency=concurrency, rate_limit=rate_limit, on_result=save)
+
 
-    # Make API calls to get all latitutes and longitudes
-    for district in df["District_Name"].unique():
-        url = f"http://api.weatherapi.com/v1/current.json?key={api_key}&q={district} {state}&aqi=no"
-        response = json.loads(requests.get(url).content)
+_refresh_lock = threading.Lock()
+_refreshed_at = {}
 
-        if 'error' in response or 'location' not in response :
-            print(f"\nCoordinates for {district} could not be found! Enter coordinates manually.")
-            lat_lon_df.loc[len(lat_lon_df)] = [district, np.nan, np.nan]
-            continue
-        elif response["location"]["country"] != "India" or state not in response["location"]["region"]:
-            print(f"\nCoordinates for {district} were not found in the region you were looking for! Enter coordinates manually.")
-            lat_lon_df.loc[len(lat_lon_df)] = [district, np.nan, np.nan]
-            continue
-        
-        lat_lon_df.loc[len(lat_lon_df)] = [district, response["location"]["lat"], response["location"]["lon"]]
 
-    lat_lon_df.to_csv(lat_lon_file, index=False)
+# Geocodes the districts of the given states (all states by default) that are not in
+# the database yet, or were not found more than GEO_RETRY_MISSES_AFTER_SECONDS ago,
+# on a background thread, so pages never wait on the network. A state is refreshed
+# at most once per GEO_REFRESH_INTERVAL_SECONDS.
+def start_background_refresh(states=None):
+    states = INDIAN_STATE_LIST if states is None else states
+    now = time.monotonic()
+    with _refresh_lock:
+        due_states = [
+            state for state in states
+            if now - _refreshed_at.get(state, -GEO_REFRESH_INTERVAL_SECONDS) >= GEO_REFRESH_INTERVAL_SECONDS
+        ]
+        _refreshed_at.update((state, now) for state in due_states)
+    if due_states:
+        threading.Thread(target=_refresh_states, args=(due_states,), name="geocode-refresh", daemon=True).start()
+
+
+# Districts of the crop data without coordinates in the database, per state
+def missing_coordinates():
+    missing = {}
+    for state in INDIAN_STATE_LIST:
+        districts = get_crop_index().select(State_Name=state)["District_Name"].unique().tolist()
+        stored = geocode_store.get_state_coordinates(state).dropna(subset=["lat", "lon"])
+        located = set(stored["District_Name"])
+        missing_districts = [district for district in districts if district not in located]
+        if missing_districts:
+            missing[state] = missing_districts
+    return missing
+
+
+def _refresh_states(states):
+    for state in states:
+        try:
+            fill_state_coordinates(state, retry_misses_after=GEO_RETRY_MISSES_AFTER_SECONDS)
+        except Exception as e:
+            print(f"Background geocoding of {state} failed: {e}")
 
 
 if __name__ == "__main__":
     # Check if the user has provided at least one argument for the state
     if len(sys.argv) < 2:
-        print("Usage: python script_name.py <state>")
+        print("Usage: python script_name.py <state> | --all | --build")
         sys.exit(1)  # Exit the script with a non-zero status to indicate an error
 
+    if sys.argv[1] in ("--all", "--build"):
+        # Fill (or resume filling) the database for every state. The build looks up
+        # earlier misses again, so the packaged table is as complete as it can be.
+        for state in INDIAN_STATE_LIST:
+            fill_state_coordinates(state, retry_misses=sys.argv[1] == "--build")
+        print(geocode_store.status_counts())
+        missing = missing_coordinates()
+        if sys.argv[1] == "--build":
+            # Bake the coordinates into the table packaged with the app
+            count = geocode_store.export_district_coordinates()
+            print(f"Wrote {count} districts to {geocode_store.DISTRICT_COORDINATES_FILE}")
+        for state, districts in missing.items():
+            print(f"{state}: {len(districts)} districts without coordinates: {', '.join(districts)}")
+        print_summary()
+        # an incomplete table fails the build, so it is not shipped by accident
+        sys.exit(1 if missing else 0)
+
     # Get the state argument from the command line but user will have to pass state in the correct case
     # eg. 'Tamil Nadu' is correct, but 'tamil nadu'/'tamil Nadu'/'Tamil nadu' are not
     state = ' '.join(sys.argv[1:])
 
     # Call the function to process the state
-    generate_lat_lon_csv(state)
\ No newline at end of file
+    fill_state_coordinates(state)
+    print(geocode_store.status_counts(state))
+    print_summary()
\ No newline at end of file
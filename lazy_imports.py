@@ -0,0 +1,83 @@
+import importlib
+import subprocess
+import sys
+import threading
+import time
+
+# Modules the pages only need for some features, imported on first use
+HEAVY_MODULES = [
+    "altair",
+    "matplotlib.pyplot",
+    "seaborn",
+    "pydeck",
+    "google.generativeai",
+    "speech_recognition",
+    "googlesearch",
+    "deep_translator",
+    "gtts",
+    "pygame",
+]
+
+_lock = threading.Lock()
+# Seconds every lazily imported module took to import in this process
+import_times = {}
+
+
+# Stands in for a module until one of its attributes is used, then imports it. The
+# import happens once per process and its duration is kept in import_times.
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    already_imported = self._name in sys.modules
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    if not already_imported:
+                        import_times[self._name] = time.perf_counter() - start
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+# e.g. `sns = lazy_import("seaborn")` at the top of a page, used like the module
+def lazy_import(name):
+    return LazyModule(name)
+
+
+# Import times of the lazily loaded modules of this process, slowest first
+def import_report():
+    return sorted(import_times.items(), key=lambda item: item[1], reverse=True)
+
+
+# Cold import time of a module, measured in a fresh interpreter. None when the
+# module is not installed.
+def measure_import(name):
+    code = f"import time, importlib; start = time.perf_counter(); importlib.import_module({name!r}); print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    # Prints how long every heavy module takes to import on a cold start, i.e. what
+    # a page would pay if it imported the module eagerly
+    modules = sys.argv[1:] or HEAVY_MODULES
+    timings = [(name, measure_import(name)) for name in modules]
+    timings.sort(key=lambda item: -1 if item[1] is None else item[1], reverse=True)
+    print(f"{'Module':<24}Import time")
+    for name, seconds in timings:
+        print(f"{name:<24}{'not installed' if seconds is None else f'{seconds * 1000:8.0f} ms'}")
+    total = sum(seconds for _, seconds in timings if seconds is not None)
+    print(f"\nTotal (modules share dependencies, so this overstates a combined import): {total:.2f} s")
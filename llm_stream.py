@@ -0,0 +1,53 @@
+import re
+
+# A sentence ends at . ! ? (not after a digit, so "1." in a list does not count) or
+# at the Devanagari danda, followed by whitespace, or at a line break
+SENTENCE_END = re.compile(r"(?<=\D[.!?])\s+|(?<=।)\s+|\n+")
+
+
+# Cuts text that arrives in pieces into sentences. A sentence is handed out as soon
+# as the whitespace after it has arrived, with that whitespace kept so callers can
+# tell a line break from a space.
+class SentenceSplitter:
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            sentences.append(self._buffer[start:match.end()])
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return [sentence for sentence in sentences if sentence.strip()]
+
+    # What is left once the text is complete
+    def flush(self):
+        rest, self._buffer = self._buffer, ""
+        return [rest] if rest.strip() else []
+
+
+# The text of a streamed Gemini response (generate_content(..., stream=True)) as it
+# arrives. Chunks without text, e.g. ones that only carry safety ratings, are skipped.
+def stream_text(response):
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue
+        if text:
+            yield text
+
+
+# Passes the pieces of a stream through unchanged, calling on_sentence with every
+# sentence as soon as it is complete, so work on the first sentences can start while
+# the rest is still being generated
+def tee_sentences(pieces, on_sentence):
+    splitter = SentenceSplitter()
+    for piece in pieces:
+        yield piece
+        for sentence in splitter.feed(piece):
+            on_sentence(sentence)
+    for sentence in splitter.flush():
+        on_sentence(sentence)
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+
+# The only columns the map layers and their tooltip read
+LAYER_COLUMNS = ["District_Name", "lat", "lon", "Area", "Production"]
+# Decimals kept for coordinates, 4 decimals is about 10 m
+COORDINATE_DECIMALS = 4
+
+
+# Shrinks a layer frame before it is serialized to JSON for the browser: rounded
+# coordinates and whole number totals, so every row stays short. Only the payload of
+# the maps is compacted, tables show the exact values.
+def compact_layer_data(layer_data):
+    layer_data = layer_data.copy()
+    layer_data["lat"] = layer_data["lat"].round(COORDINATE_DECIMALS)
+    layer_data["lon"] = layer_data["lon"].round(COORDINATE_DECIMALS)
+    for column in ["Area", "Production"]:
+        layer_data[column] = layer_data[column].fillna(0).round().astype("int64")
+    return layer_data.reset_index(drop=True)
+
+
+# One row per district with the total area and production of the given crop rows.
+# Rows from several states are grouped per state as well, since district names
+# repeat across states, and keep their State_Name column. Extra grouping columns
+# can be given with by, they are kept in front of the district columns.
+def district_layer_data(rows, by=()):
+    keys = list(by) + (["State_Name", "District_Name"] if "State_Name" in rows else ["District_Name"])
+    columns = list(dict.fromkeys(keys + LAYER_COLUMNS))
+    layer_data = rows[columns].groupby(keys, observed=True, sort=False).agg(
+        lat=("lat", "first"),
+        lon=("lon", "first"),
+        Area=("Area", "sum"),
+        Production=("Production", "sum"),
+    )
+    return layer_data.reset_index()[columns]
+
+
+# District totals of every year in one grouped pass, as one long compacted frame
+# with a Crop_Year column, so all years can be shipped to the browser together
+def year_layer_data(rows):
+    return compact_layer_data(district_layer_data(rows, by=["Crop_Year"]))
+
+
+# Bins district rows to a square grid of cell_degrees and returns one row per cell,
+# placed at the area weighted centre of its districts. Used for views that cover
+# far more districts than fit on screen, like the whole country.
+def grid_layer_data(rows, cell_degrees):
+    districts = district_layer_data(rows)
+    if districts.empty:
+        return districts
+    cells = pd.DataFrame(
+        {
+            "cell_lat": np.floor(districts["lat"] / cell_degrees).astype("int32"),
+            "cell_lon": np.floor(districts["lon"] / cell_degrees).astype("int32"),
+            "weight": districts["Area"].clip(lower=1),
+        }
+    )
+    cells["weighted_lat"] = districts["lat"] * cells["weight"]
+    cells["weighted_lon"] = districts["lon"] * cells["weight"]
+    cells["Area"] = districts["Area"]
+    cells["Production"] = districts["Production"]
+    cells["districts"] = 1
+    grid = cells.groupby(["cell_lat", "cell_lon"], sort=False).sum()
+    layer_data = pd.DataFrame(
+        {
+            "District_Name": grid["districts"].astype(str) + " districts",
+            "lat": grid["weighted_lat"] / grid["weight"],
+            "lon": grid["weighted_lon"] / grid["weight"],
+            "Area": grid["Area"],
+            "Production": grid["Production"],
+        }
+    )
+    return layer_data.reset_index(drop=True)
+
+
+# Layer data for the map: per district, or binned to a grid when cell_degrees is given
+@timed("map.layer_data")
+def build_layer_data(rows, cell_degrees=None):
+    if cell_degrees:
+        return grid_layer_data(rows, cell_degrees)
+    return district_layer_data(rows)
@@ -0,0 +1,152 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import geocode_store
+from coordinate_resolver import FALLBACK_COORDINATES
+from crop_data import get_crop_data_version
+from crop_index import get_crop_index
+from instrumentation import timed
+from map_layers import district_layer_data, grid_layer_data
+
+# Roughly the middle of India, where the national view starts
+INDIA_CENTER = (22.5, 80.0)
+# Side of the square tiles the district points are split into, in degrees
+TILE_DEGREES = 4.0
+# Below STATE_ZOOM only state totals are sent, below DISTRICT_ZOOM the visible
+# districts are binned to a GRID_DEGREES grid, above it they are sent one by one
+STATE_ZOOM = 5
+DISTRICT_ZOOM = 6.5
+GRID_DEGREES = 1.0
+# Size of the map in pixels, used to work out what part of India is visible
+VIEWPORT_PIXELS = (700, 500)
+CACHED_SLICES = 32
+
+
+# Every located district of every state, stored coordinates first and the fallback
+# table for whatever is still missing
+def _all_coordinates():
+    stored = geocode_store.get_all_coordinates().set_index(["State_Name", "District_Name"])[["lat", "lon"]]
+    return stored.combine_first(FALLBACK_COORDINATES).reset_index()
+
+
+# The district totals of one (year, crop, season) for the whole country, split into
+# tiles so a view only touches the districts of the tiles it overlaps
+class NationalSlice:
+    @timed("map.national_slice")
+    def __init__(self, crop_year, crop, season, coordinates):
+        rows = get_crop_index().select(Crop_Year=crop_year, Crop=crop, Season=season)
+        rows = rows.astype({"State_Name": str, "District_Name": str})
+        rows = pd.merge(rows, coordinates, on=["State_Name", "District_Name"])
+        districts = district_layer_data(rows)
+
+        tile_x = np.floor(districts["lon"] / TILE_DEGREES).astype(int)
+        tile_y = np.floor(districts["lat"] / TILE_DEGREES).astype(int)
+        self.tiles = {tile: group for tile, group in districts.groupby([tile_x, tile_y], sort=False)}
+        self.districts = districts
+        self.states = self._state_totals(districts)
+
+    # One point per state at the area weighted centre of its districts
+    @staticmethod
+    def _state_totals(districts):
+        weight = districts["Area"].clip(lower=1)
+        weighted = districts.assign(
+            weighted_lat=districts["lat"] * weight, weighted_lon=districts["lon"] * weight, weight=weight
+        )
+        totals = (
+            weighted.groupby("State_Name", sort=False)
+            .agg({column: "sum" for column in ["weighted_lat", "weighted_lon", "weight", "Area", "Production"]})
+        )
+        states = pd.DataFrame(
+            {
+                "District_Name": totals.index,
+                "lat": totals["weighted_lat"] / totals["weight"],
+                "lon": totals["weighted_lon"] / totals["weight"],
+                "Area": totals["Area"],
+                "Production": totals["Production"],
+            }
+        )
+        return states.reset_index(drop=True)
+
+    # Districts in the tiles that overlap a (south, west, north, east) box
+    def districts_in(self, bounds):
+        south, west, north, east = bounds
+        parts = [
+            self.tiles[(x, y)]
+            for x in range(math.floor(west / TILE_DEGREES), math.floor(east / TILE_DEGREES) + 1)
+            for y in range(math.floor(south / TILE_DEGREES), math.floor(north / TILE_DEGREES) + 1)
+            if (x, y) in self.tiles
+        ]
+        if not parts:
+            return self.districts.iloc[:0]
+        return pd.concat(parts, ignore_index=True)
+
+
+# The box visible on a web mercator map of VIEWPORT_PIXELS centred on a point
+def visible_bounds(latitude, longitude, zoom):
+    degrees_per_pixel = 360 / (256 * 2**zoom)
+    half_width = VIEWPORT_PIXELS[0] / 2 * degrees_per_pixel
+    half_height = VIEWPORT_PIXELS[1] / 2 * degrees_per_pixel * math.cos(math.radians(latitude))
+    return (latitude - half_height, longitude - half_width, latitude + half_height, longitude + half_width)
+
+
+_lock = threading.Lock()
+_slices = OrderedDict()
+_coordinates = None
+_coordinates_revision = None
+
+
+def _revision():
+    return (get_crop_data_version(), geocode_store.state_revision())
+
+
+# Coordinates of every located district, reloaded when any stored coordinate changes
+def _get_coordinates(revision):
+    global _coordinates, _coordinates_revision
+    with _lock:
+        if _coordinates is None or _coordinates_revision != revision:
+            _coordinates = _all_coordinates()
+            _coordinates_revision = revision
+        return _coordinates
+
+
+def get_national_slice(crop_year, crop, season):
+    revision = _revision()
+    key = (revision, crop_year, crop, season)
+    with _lock:
+        national_slice = _slices.get(key)
+        if national_slice is not None:
+            _slices.move_to_end(key)
+            return national_slice
+    national_slice = NationalSlice(crop_year, crop, season, _get_coordinates(revision))
+    with _lock:
+        _slices[key] = national_slice
+        while len(_slices) > CACHED_SLICES:
+            _slices.popitem(last=False)
+    return national_slice
+
+
+# Centre of the located districts of a state, the middle of India if it has none
+def get_state_centre(state):
+    coordinates = _get_coordinates(_revision())
+    located = coordinates[coordinates["State_Name"] == state]
+    if located.empty:
+        return INDIA_CENTER
+    return float(located["lat"].mean()), float(located["lon"].mean())
+
+
+# Level of detail for the national map. Returns the detail level ("state", "grid"
+# or "district") and the layer data for the view, so the payload stays small
+# however much of the country has coordinates.
+@timed("map.national_layer_data")
+def national_layer_data(crop_year, crop, season, latitude, longitude, zoom):
+    national_slice = get_national_slice(crop_year, crop, season)
+    if zoom < STATE_ZOOM:
+        return "state", national_slice.states
+    districts = national_slice.districts_in(visible_bounds(latitude, longitude, zoom))
+    if zoom < DISTRICT_ZOOM:
+        return "grid", grid_layer_data(districts, GRID_DEGREES)
+    return "district", districts
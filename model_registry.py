@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import joblib
+
+from instrumentation import timed
+
+
+# Current resident set size of this process in bytes, None where /proc is not available
+def _resident_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Entry:
+    def __init__(self, path, mmap_mode, warm_up):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.warm_up = warm_up
+        self.obj = None
+        self.load_seconds = None
+        self.warm_up_seconds = None
+        self.resident_bytes = None
+        self.lock = threading.Lock()
+
+
+# Keeps joblib artifacts loaded once per server process. Every artifact is loaded on
+# first use (memory mapped when mmap_mode is given and the pickle is uncompressed),
+# optionally warmed up, and the time and memory this took is kept for reporting.
+class ModelRegistry:
+    def __init__(self):
+        self._entries = {}
+
+    def register(self, name, path, mmap_mode=None, warm_up=None):
+        if name not in self._entries:
+            self._entries[name] = _Entry(path, mmap_mode, warm_up)
+
+    def get(self, name):
+        entry = self._entries[name]
+        if entry.obj is not None:
+            return entry.obj
+        with entry.lock:
+            if entry.obj is None:
+                resident_before = _resident_bytes()
+                start = time.perf_counter()
+                with timed(f"model_registry.load.{name}"):
+                    obj = joblib.load(entry.path, mmap_mode=entry.mmap_mode)
+                entry.load_seconds = time.perf_counter() - start
+                resident_after = _resident_bytes()
+                if resident_before is not None and resident_after is not None:
+                    # approximate, other threads allocate at the same time
+                    entry.resident_bytes = max(resident_after - resident_before, 0)
+                if entry.warm_up is not None:
+                    start = time.perf_counter()
+                    entry.warm_up(obj)
+                    entry.warm_up_seconds = time.perf_counter() - start
+                entry.obj = obj
+        return entry.obj
+
+    def stats(self):
+        return [
+            {
+                "name": name,
+                "path": entry.path,
+                "loaded": entry.obj is not None,
+                "file_bytes": os.path.getsize(entry.path) if os.path.isfile(entry.path) else None,
+                "load_seconds": entry.load_seconds,
+                "warm_up_seconds": entry.warm_up_seconds,
+                "resident_bytes": entry.resident_bytes,
+            }
+            for name, entry in self._entries.items()
+        ]
+
+
+registry = ModelRegistry()
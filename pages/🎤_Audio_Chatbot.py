@@ -1,21 +1,35 @@
 import streamlit as st
-import speech_recognition as sr
-from googlesearch import search
+import streamlit.components.v1 as components
 
+import base64
+import json
 import logging
-from deep_translator import GoogleTranslator
-import google.generativeai as genai
-from gtts import gTTS
 from io import BytesIO
 import time
 import re
 import os
 from dotenv import load_dotenv
 from st_audiorec import st_audiorec
+from instrumentation import debug_panel, timed
+from lazy_imports import lazy_import
+from llm_stream import stream_text, tee_sentences
+from speech import InOrder, join_clips, synthesize
+from stage_pipeline import FAILED, Pipeline, Stage
+from translation import translator
+
+# Imported on first use, a rerun that only changes the language loads none of them
+sr = lazy_import("speech_recognition")
+googlesearch = lazy_import("googlesearch")
+genai = lazy_import("google.generativeai")
 
 load_dotenv()
 
+# Seconds a stage of the answer pipeline may take before the page gives up on it.
+# regional is per batch of sentences, tts per sentence, llm is the whole streamed answer.
+STAGE_TIMEOUTS = {"search": 10, "llm": 60, "regional": 20, "tts": 30}
+
 st.set_page_config("Audio Chatbot", page_icon=":microphone:")
+debug_panel()
 
 languages = {
     "Hindi": "hi",
@@ -49,6 +63,7 @@ selected_language = languages[language]
 
 
 # Function number 1
+@timed("chatbot.transcribe")
 def transcribe_audio(audio_data):
     recognizer = sr.Recognizer()
     
@@ -89,12 +104,12 @@ def transcribe_audio(audio_data):
 
 
 # Function number 2
+@timed("chatbot.translate_to_english")
 def translate_to_english(text, source_language):
     if text is None:
         return "Unable to translate: No input text"
     try:
-        translator = GoogleTranslator(source=source_language, target="en")
-        translation = translator.translate(text)
+        translation = translator.translate(text, source_language, "en")
         return translation
     except Exception as e:
         logging.error(f"Error during translation: {e}")
@@ -102,25 +117,34 @@ def translate_to_english(text, source_language):
 
 
 # function number 3
-# does simple google searches and gets the top links
+# does simple google searches and gets the top links. Runs on a worker thread, so
+# errors are returned to be shown by the page: returns (links, error).
+@timed("chatbot.search")
 def search_google(query):
     results = []
     try:
-        for j in search(query, num_results=5, sleep_interval=2):
+        for j in googlesearch.search(query, num_results=5):
             results.append(j)
     except Exception as e:
-        st.error(f"Search error: {e}")
         # Fallback to a simple search result
-        results = [f"Search for: {query}"]
-    return results
+        return [f"Search for: {query}"], f"Search error: {e}"
+    return results, None
 
 
 # Settings for LLM
 # gemini API - only configure if API key is available
-gemini_model = None
 api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
 
-if api_key:
+if not api_key:
+    st.info("ℹ️ No Google API key found. AI responses will use a simple fallback.")
+
+
+# Creates the Gemini model when a response is needed, so google.generativeai is not
+# imported by reruns that never reach the LLM. Returns (model, error), the model is
+# None without an API key or when it could not be created.
+def load_gemini_model():
+    if not api_key:
+        return None, None
     try:
         genai.configure(api_key=api_key)
         
@@ -153,111 +177,94 @@ if api_key:
         ]
 
         # actually creates the LLM responsible for giving the output
-        gemini_model = genai.GenerativeModel(
+        return genai.GenerativeModel(
             model_name="gemini-1.5-flash-latest",
             safety_settings=safety_settings,
             generation_config=generation_config,
-        )
+        ), None
     except Exception as e:
-        st.warning(f"⚠️ Could not initialize Gemini AI: {e}")
-        gemini_model = None
-else:
-    st.info("ℹ️ No Google API key found. AI responses will use a simple fallback.")
+        logging.error(f"Could not initialize Gemini AI: {e}")
+        return None, f"Could not initialize Gemini AI: {e}"
 
 
 # function number 4
-def generate_content_with_LLM(prompt):
+# Streams the answer of the model from load_gemini_model: yields its text as Gemini
+# generates it instead of waiting for the whole response
+def generate_content_with_LLM(prompt, gemini_model):
     if gemini_model is None:
         # Fallback response when no API key is available
-        return f"Based on your query '{prompt}', here's some helpful information:\n\n" \
-               f"• This is a crop-related query about agricultural practices\n" \
-               f"• For detailed information, please check the search results above\n" \
-               f"• Consider consulting local agricultural experts for specific advice\n\n" \
-               f"Note: To get AI-powered responses, please add your Google API key to the environment variables."
+        yield f"Based on your query '{prompt}', here's some helpful information:\n\n" \
+              f"• This is a crop-related query about agricultural practices\n" \
+              f"• For detailed information, please check the search results above\n" \
+              f"• Consider consulting local agricultural experts for specific advice\n\n" \
+              f"Note: To get AI-powered responses, please add your Google API key to the environment variables."
+        return
     
-    try:
-        response = gemini_model.generate_content(prompt)
-        output = response.text
-        return output
+    with timed("chatbot.llm"):
+        try:
+            response = gemini_model.generate_content(
+                prompt, stream=True, request_options={"timeout": STAGE_TIMEOUTS["llm"]}
+            )
+            yield from stream_text(response)
 
-    except Exception as e:
-        logging.error(f"Error during content generation - {e}")
-        return f"I encountered an error while generating a response. Here's what I can tell you about your query '{prompt}':\n\n" \
-               f"• This appears to be a question about crops and agriculture\n" \
-               f"• Please check the search results above for more detailed information\n" \
-               f"• For specific agricultural advice, consider consulting local farming experts"
+        except Exception as e:
+            logging.error(f"Error during content generation - {e}")
+            yield f"I encountered an error while generating a response. Here's what I can tell you about your query '{prompt}':\n\n" \
+                  f"• This appears to be a question about crops and agriculture\n" \
+                  f"• Please check the search results above for more detailed information\n" \
+                  f"• For specific agricultural advice, consider consulting local farming experts"
 
 
 # function number 5 to translate back into regional language
-def translate_to_regional_language(text, target_language):
+# Translates a batch of English sentences together, in as few requests as the
+# translator allows. Runs on a worker thread, errors are logged and raised so the
+# page can show the sentences in English instead.
+@timed("chatbot.translate_to_regional")
+def translate_to_regional_language(sentences, target_language):
     try:
-        translator = GoogleTranslator(source="en", target=target_language)
-        translation = translator.translate(text)
-        return translation
+        return translator.translate_sentences(sentences, "en", target_language)
     except Exception as e:
         logging.error(f"Error during translation to regional language: {e}")
-        return "Unable to translate to regional language due to an error"
+        raise
 
 
 # function number 5
+# speaks one sentence of the answer, falling back to English if the language fails.
+# Runs on a worker thread, so problems are logged and None is returned instead.
+@timed("chatbot.tts")
 def text_to_speech(text, language):
     if not text or not text.strip():
-        st.warning("⚠️ No text provided for audio generation")
+        logging.warning("No text provided for audio generation")
         return None
-        
+
     cleaned_text = remove_emojis_and_symbols(text)
     
-    # Limit text length to avoid issues
-    if len(cleaned_text) > 500:
-        cleaned_text = cleaned_text[:500] + "..."
+    # Use a more reliable language code mapping
+    lang_codes = {
+        "hi": "hi",  # Hindi
+        "mr": "mr",  # Marathi
+        "ta": "ta",  # Tamil
+        "te": "te",  # Telugu
+        "bn": "bn",  # Bengali
+        "gu": "gu",  # Gujarati
+        "kn": "kn",  # Kannada
+        "ml": "ml",  # Malayalam
+        "ur": "ur",  # Urdu
+    }
+    
+    lang_code = lang_codes.get(language, "en")  # Default to English if language not found
     
     try:
-        # Use a more reliable language code mapping
-        lang_codes = {
-            "hi": "hi",  # Hindi
-            "mr": "mr",  # Marathi
-            "ta": "ta",  # Tamil
-            "te": "te",  # Telugu
-            "bn": "bn",  # Bengali
-            "gu": "gu",  # Gujarati
-            "kn": "kn",  # Kannada
-            "ml": "ml",  # Malayalam
-            "ur": "ur",  # Urdu
-        }
-        
-        lang_code = lang_codes.get(language, "en")  # Default to English if language not found
-        
-        
-        tts = gTTS(text=cleaned_text, lang=lang_code, slow=False)
-        audio_bytes = BytesIO()
-        tts.write_to_fp(audio_bytes)
-        audio_bytes.seek(0)
-        
-        # Check if audio was generated successfully
-        audio_data = audio_bytes.getvalue()
-        if audio_data and len(audio_data) > 0:
-            st.success(f"✅ Audio bytes generated successfully ({len(audio_data)} bytes)")
-            # Reset the BytesIO object for proper reading
-            audio_bytes.seek(0)
-            return audio_bytes
-        else:
-            st.error("❌ Audio generation produced empty result")
-            return None
-            
+        return BytesIO(synthesize(cleaned_text, lang_code))
     except Exception as e:
-        st.error(f"❌ Text-to-speech error: {e}")
-        st.info("💡 Trying with English as fallback...")
-        
-        # Fallback to English
-        try:
-            tts = gTTS(text=cleaned_text, lang="en", slow=False)
-            audio_bytes = BytesIO()
-            tts.write_to_fp(audio_bytes)
-            audio_bytes.seek(0)
-            return audio_bytes
-        except Exception as e2:
-            st.error(f"❌ Fallback audio generation also failed: {e2}")
-            return None
+        logging.error(f"Text-to-speech error, trying English as fallback: {e}")
+
+    # Fallback to English
+    try:
+        return BytesIO(synthesize(cleaned_text, "en"))
+    except Exception as e2:
+        logging.error(f"Fallback audio generation also failed: {e2}")
+        return None
 
 
 # helper function to remove emojis and symbols from the regional language output text
@@ -274,6 +281,76 @@ def remove_emojis_and_symbols(text):
     return emoji_pattern.sub(r"", text)
 
 
+# Plays the generated speech, falling back to a temporary file if the bytes cannot
+# be played directly
+def play_audio(audio_bytes):
+    if audio_bytes and audio_bytes.getvalue():
+        try:
+            # Try different audio formats for better compatibility
+            audio_data = audio_bytes.getvalue()
+            st.audio(audio_data, format="audio/mpeg")
+        except Exception as audio_error:
+            st.error(f"❌ Audio playback error: {audio_error}")
+            st.info("💡 Audio was generated but couldn't be played. You can still read the text response above.")
+            
+            # Try alternative approach - save to temporary file
+            try:
+                import tempfile
+                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
+                    tmp_file.write(audio_data)
+                    tmp_file.flush()
+                    st.audio(tmp_file.name, format="audio/mpeg")
+                    st.success("✅ Audio generated and ready to play! (Alternative method)")
+            except Exception as alt_error:
+                st.error(f"❌ Alternative audio method also failed: {alt_error}")
+                st.info("💡 You can still read the text response above.")
+    else:
+        st.warning("⚠️ Unable to generate audio for the answer.")
+        st.info("💡 This might be due to text length, language support, or network issues.")
+
+
+# Keeps one audio player in the page for the spoken answer. Every clip is handed
+# to it by a tiny component of its own. The first clip plays right away and every
+# later one once the clip before it has ended, the clips of an earlier answer are
+# dropped. The player lives in the page itself, so it keeps playing while later
+# clips arrive.
+SPEECH_QUEUE_SCRIPT = """
+(function () {
+  const host = window.parent;
+  let speech = host.chatbotSpeech;
+  if (!speech || speech.answer !== ANSWER) {
+    if (speech) speech.audio.pause();
+    speech = host.chatbotSpeech = {answer: ANSWER, clips: {}, next: 0, audio: new host.Audio()};
+    speech.audio.addEventListener("ended", () => playNext(speech));
+  }
+  speech.clips[INDEX] = SOURCE;
+  if (speech.audio.paused) playNext(speech);
+
+  function playNext(speech) {
+    const index = speech.next;
+    const source = speech.clips[index];
+    if (source === undefined) return;
+    delete speech.clips[index];
+    speech.next = index + 1;
+    speech.audio.src = source;
+    // blocked autoplay leaves the clip queued, the next clip tries again
+    speech.audio.play().catch(() => {
+      speech.clips[index] = source;
+      speech.next = index;
+    });
+  }
+})();
+"""
+
+
+# Queues clip number index (counted from 0, in sentence order) of the answer
+# answer_id on the page's audio player, see SPEECH_QUEUE_SCRIPT
+def queue_audio(clip, answer_id, index):
+    source = "data:audio/mpeg;base64," + base64.b64encode(clip).decode()
+    constants = f"const ANSWER = {json.dumps(answer_id)}, INDEX = {index}, SOURCE = {json.dumps(source)};"
+    components.html(f"<script>{constants}{SPEECH_QUEUE_SCRIPT}</script>", height=0)
+
+
 def main():
     st.title("Regional Language Audio Chatbot with Google Search and Summarization")
 
@@ -314,63 +391,175 @@ def main():
             english_text = translate_to_english(text, selected_language)
             st.success(f"🌐 **Translated Query:** {english_text}")
 
-            # fn3
-            # call the google search method and display relevant links
-            st.info("🔍 Searching Google...")
-            results = search_google(english_text)
-            with st.expander("📋 Google Search Results:"):
-                for i, result in enumerate(results, start=1):
-                    st.write(f"{i}. {result}")
-
-            st.info("🤖 Generating AI response...")
-
-            # fn4
-            llm_output = generate_content_with_LLM(english_text)
-
-            def stream_data():
-                for word in llm_output.split(" "):
-                    yield word + " "
-                    time.sleep(0.002)
-
-            st.write("**AI Response:**")
-            st.write_stream(stream_data)
-
-            # fn5
-            st.info("🔄 Translating response to regional language...")
-            regional_output = translate_to_regional_language(llm_output, selected_language)
-            st.write(f"**{language} Response:** {regional_output}")
-
-            # fn6
-            st.info("🔊 Generating audio...")
-            try:
-                audio_bytes = text_to_speech(regional_output, selected_language)
-                if audio_bytes and audio_bytes.getvalue():
-                    try:
-                        # Try different audio formats for better compatibility
-                        audio_data = audio_bytes.getvalue()
-                        st.audio(audio_data, format="audio/mpeg")
-                        st.success("✅ Audio generated and ready to play!")
-                    except Exception as audio_error:
-                        st.error(f"❌ Audio playback error: {audio_error}")
-                        st.info("💡 Audio was generated but couldn't be played. You can still read the text response above.")
-                        
-                        # Try alternative approach - save to temporary file
-                        try:
-                            import tempfile
-                            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-                                tmp_file.write(audio_data)
-                                tmp_file.flush()
-                                st.audio(tmp_file.name, format="audio/mpeg")
-                                st.success("✅ Audio generated and ready to play! (Alternative method)")
-                        except Exception as alt_error:
-                            st.error(f"❌ Alternative audio method also failed: {alt_error}")
-                            st.info("💡 You can still read the text response above.")
+            # fn3 to fn6
+            # the google search does not depend on the LLM, so it runs in the
+            # background while the answer streams in. Finished sentences of the
+            # answer are translated in batches: the first one on its own, then
+            # whatever streamed in while the batch before was being translated. Every
+            # translated sentence is spoken right away, the sentences at the same
+            # time, and their audio is queued on one player in sentence order, so it
+            # starts with the first sentence. Every result is shown as soon as it
+            # arrives, in the section reserved for it.
+            st.info("🔍 Searching Google and 🤖 generating the AI response...")
+            search_area = st.container()
+            response_area = st.container()
+            regional_area = st.container()
+            audio_area = st.container()
+
+            # answer sentences in order, the batches they are translated in (lists of
+            # sentence numbers), the batches that came back and the sentences still
+            # waiting for one, what each sentence was translated to, and their audio,
+            # released in sentence order
+            sentences = []
+            batches = []
+            batches_done = set()
+            waiting = []
+            translations = {}
+            clips = InOrder()
+            audio_parts = []
+            answer_id = str(time.time_ns())
+            first_audio = []
+            with regional_area:
+                regional_text = st.empty()
+            with audio_area:
+                audio_progress = st.empty()
+
+            def show_regional():
+                # the translated sentences in order, up to the first one still missing
+                parts = []
+                for i, sentence in enumerate(sentences):
+                    if i not in translations:
+                        break
+                    parts.append(translations[i] + ("\n\n" if sentence.endswith("\n") else " "))
+                if parts:
+                    regional_text.write(f"**{language} Response:** " + "".join(parts))
+
+            def show_result(result):
+                if result.name == "search":
+                    with search_area:
+                        if result.ok:
+                            links, error = result.value
+                            if error:
+                                st.error(error)
+                            with st.expander("📋 Google Search Results:"):
+                                for i, link in enumerate(links, start=1):
+                                    st.write(f"{i}. {link}")
+                        else:
+                            st.warning(f"⚠️ Google search {result.status}, showing the answer without search results.")
+                elif result.name.startswith("regional"):
+                    k = int(result.name.split("_")[1])
+                    batches_done.add(k)
+                    batch = batches[k]
+                    if result.ok:
+                        for i, translation in zip(batch, result.value):
+                            translations[i] = translation
+                            speak_sentence(i, translation, selected_language)
+                    else:
+                        with regional_area:
+                            st.warning(f"⚠️ Translation of part of the answer to {language} {result.status}, showing it in English.")
+                        for i in batch:
+                            translations[i] = sentences[i].strip()
+                            speak_sentence(i, translations[i], "en")
+                    show_regional()
+                    translate_waiting()
+                elif result.name.startswith("tts"):
+                    i = int(result.name.split("_")[1])
+                    if not result.ok or result.value is None:
+                        status = result.status if not result.ok else FAILED
+                        with audio_area:
+                            st.warning(f"⚠️ Audio generation {status} for a sentence, it is left out.")
+                    for clip in clips.put(i, result.value if result.ok else None):
+                        if clip is not None:
+                            with audio_area:
+                                queue_audio(clip.getvalue(), answer_id, len(audio_parts))
+                            audio_parts.append(clip.getvalue())
+                            if not first_audio:
+                                first_audio.append(time.perf_counter() - answer_start)
+                    if audio_parts:
+                        audio_progress.caption(f"🔊 Speaking the answer, audio of {len(audio_parts)} sentences ready...")
+
+            with Pipeline(
+                [Stage("search", lambda: search_google(english_text), timeout=STAGE_TIMEOUTS["search"])]
+            ) as pipeline:
+
+                def translate_sentence(sentence):
+                    waiting.append(len(sentences))
+                    sentences.append(sentence)
+                    # one batch at a time, later sentences wait for the next one
+                    if len(batches_done) == len(batches):
+                        translate_waiting()
+
+                def translate_waiting():
+                    if not waiting:
+                        return
+                    batch = waiting[:]
+                    waiting.clear()
+                    batches.append(batch)
+                    batch_sentences = [sentences[i].strip() for i in batch]
+                    pipeline.add(
+                        Stage(
+                            f"regional_{len(batches) - 1}",
+                            lambda: translate_to_regional_language(batch_sentences, selected_language),
+                            timeout=STAGE_TIMEOUTS["regional"],
+                        )
+                    )
+
+                def speak_sentence(i, text, tts_language):
+                    pipeline.add(
+                        Stage(f"tts_{i}", lambda: text_to_speech(text, tts_language), timeout=STAGE_TIMEOUTS["tts"])
+                    )
+
+                # the answer as Gemini produces it, showing whatever else finished
+                # in the meantime
+                answer_start = time.perf_counter()
+                first_words = []
+                gemini_model, model_error = load_gemini_model()
+
+                def stream_answer():
+                    answer = generate_content_with_LLM(english_text, gemini_model)
+                    for piece in tee_sentences(answer, translate_sentence):
+                        if not first_words:
+                            first_words.append(time.perf_counter() - answer_start)
+                        yield piece
+                        for result in pipeline.poll():
+                            show_result(result)
+
+                with response_area:
+                    st.write("**AI Response:**")
+                    if model_error:
+                        st.warning(f"⚠️ {model_error}")
+                    st.write_stream(stream_answer)
+                answer_seconds = time.perf_counter() - answer_start
+                results = pipeline.wait(on_result=show_result)
+
+            # the whole answer as one clip, to play it again
+            audio_progress.empty()
+            with audio_area:
+                if audio_parts:
+                    st.success("✅ Audio of the whole answer, to play it again:")
+                    play_audio(BytesIO(join_clips(audio_parts)))
                 else:
-                    st.warning("⚠️ Unable to generate audio for the answer.")
-                    st.info("💡 This might be due to text length, language support, or network issues.")
-            except Exception as e:
-                st.error(f"❌ Audio generation failed: {e}")
-                st.info("💡 You can still read the text response above.")
+                    play_audio(None)
+
+            # latency of this answer
+            search = results["search"]
+            timings = [f"search {search.seconds:.1f}s" + ("" if search.ok else f" ({search.status})")]
+            if first_words:
+                timings.append(f"first words {first_words[0]:.1f}s")
+            timings.append(f"answer {answer_seconds:.1f}s")
+            translated = [results[f"regional_{k}"] for k in range(len(batches))]
+            if translated:
+                slowest = max(result.seconds for result in translated)
+                timings.append(
+                    f"translation of {len(sentences)} sentences in {len(translated)} batches, slowest {slowest:.1f}s"
+                )
+            spoken = [results[f"tts_{i}"] for i in range(len(sentences)) if results[f"tts_{i}"].ok]
+            if spoken:
+                slowest = max(result.seconds for result in spoken)
+                timings.append(f"tts of {len(spoken)} sentences, slowest {slowest:.1f}s")
+            if first_audio:
+                timings.append(f"first audio {first_audio[0]:.1f}s")
+            st.caption("⏱️ " + " · ".join(timings))
         else:
             st.error("❌ No audio data received. Please try recording again.")
 
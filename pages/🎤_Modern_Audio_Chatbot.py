@@ -1,15 +1,25 @@
 import streamlit as st
-import speech_recognition as sr
 import time
 import os
+import re
 from datetime import datetime
-from deep_translator import GoogleTranslator
-import google.generativeai as genai
 from dotenv import load_dotenv
 import tempfile
 from st_audiorec import st_audiorec
-from gtts import gTTS
-import pygame
+from instrumentation import debug_panel, timed
+from lazy_imports import lazy_import
+from llm_stream import stream_text, tee_sentences
+from speech import SentenceSpeech, speech_player, split_sentences, synthesize
+from translation import translator
+
+# Imported on first use, so showing the conversation does not load the speech,
+# translation, LLM and audio libraries
+sr = lazy_import("speech_recognition")
+genai = lazy_import("google.generativeai")
+pygame = lazy_import("pygame")
+
+# Seconds one sentence may take to synthesize before it is left out
+TTS_TIMEOUT = 30
 
 load_dotenv()
 
@@ -19,6 +29,7 @@ st.set_page_config(
     page_icon="🎤",
     layout="wide"
 )
+debug_panel()
 
 # Initialize session state
 if 'conversation_history' not in st.session_state:
@@ -27,14 +38,13 @@ if 'current_language' not in st.session_state:
     st.session_state.current_language = "hi"
 if 'is_playing_audio' not in st.session_state:
     st.session_state.is_playing_audio = False
-if 'current_audio_file' not in st.session_state:
-    st.session_state.current_audio_file = None
 if 'last_processed_audio' not in st.session_state:
     st.session_state.last_processed_audio = None
 if 'last_processed_text' not in st.session_state:
     st.session_state.last_processed_text = None
 
 # Initialize AI
+@timed("chatbot.initialize_ai")
 def initialize_ai():
     api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
     if api_key:
@@ -47,11 +57,14 @@ def initialize_ai():
             return None
     return None
 
-# Initialize TTS
+# Initialize TTS. The pygame mixer is process wide, so it is only set up the first
+# time something is spoken and reused by every later rerun and session.
+@timed("chatbot.initialize_tts")
 def initialize_tts():
     try:
+        if pygame.mixer.get_init():
+            return True
         # Try to initialize pygame mixer with dummy driver for headless environments
-        import os
         os.environ['SDL_AUDIODRIVER'] = 'dummy'
         pygame.mixer.pre_init(frequency=22050, size=-16, channels=2, buffer=512)
         pygame.mixer.init()
@@ -66,22 +79,23 @@ def get_audio_recording():
     return st_audiorec()
 
 # Speech recognition
+@timed("chatbot.transcribe")
 def transcribe_audio(audio_data, language="hi"):
+    tmp_name = None
     try:
         recognizer = sr.Recognizer()
         
         # Save audio data to temporary file
         with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
+            tmp_name = tmp_file.name
             tmp_file.write(audio_data)
             tmp_file.flush()
         
         # Transcribe audio
-        with sr.AudioFile(tmp_file.name) as source:
+        with sr.AudioFile(tmp_name) as source:
             audio = recognizer.record(source)
             text = recognizer.recognize_google(audio, language=f"{language}-IN")
         
-        # Clean up
-        os.unlink(tmp_file.name)
         return text, None
         
     except sr.UnknownValueError:
@@ -90,14 +104,18 @@ def transcribe_audio(audio_data, language="hi"):
         return None, f"Speech recognition service error: {e}"
     except Exception as e:
         return None, f"Audio processing error: {e}"
+    finally:
+        # Clean up, also when the recognition failed
+        if tmp_name is not None and os.path.exists(tmp_name):
+            os.unlink(tmp_name)
 
 # Translation functions
+@timed("chatbot.translate")
 def translate_text(text, source_lang, target_lang="en"):
     try:
         if source_lang == target_lang:
             return text, None
-        translator = GoogleTranslator(source=source_lang, target=target_lang)
-        translated = translator.translate(text)
+        translated = translator.translate(text, source_lang, target_lang)
         return translated, None
     except Exception as e:
         return None, f"Translation error: {e}"
@@ -117,8 +135,10 @@ def detect_language(text):
     else:
         return "en"  # English
 
-# AI response generation
-def generate_ai_response(prompt, model, detected_language="hi"):
+# AI response generation. The reply is streamed onto the page as Gemini generates it
+# and its full text is returned once it is complete. With speech (see start_speaking)
+# every sentence is spoken as soon as it is complete.
+def generate_ai_response(prompt, model, detected_language="hi", speech=None):
     if not model:
         return "AI service is not available. Please check your API key configuration.", None
     
@@ -149,56 +169,95 @@ def generate_ai_response(prompt, model, detected_language="hi"):
             6. Always respond in English
             """
         
-        response = model.generate_content(enhanced_prompt)
-        return response.text, None
+        def stream_reply():
+            with timed("chatbot.llm"):
+                response = model.generate_content(enhanced_prompt, stream=True)
+                pieces = stream_text(response)
+                if speech is not None:
+                    pieces = tee_sentences(pieces, speech.add)
+                for piece in pieces:
+                    yield piece
+                    if speech is not None:
+                        speech.poll()
+
+        st.write("**🤖 Bot:**")
+        reply = st.write_stream(stream_reply)
+        if not reply.strip():
+            return None, "AI response was empty"
+        return reply, None
     except Exception as e:
         return None, f"AI response error: {e}"
 
+# Clean text for better TTS - remove markdown and special characters
+def clean_for_speech(text):
+    cleaned_text = text
+    
+    # Remove markdown formatting
+    cleaned_text = re.sub(r'\*+', '', cleaned_text)  # Remove asterisks
+    cleaned_text = re.sub(r'#+', '', cleaned_text)   # Remove hash symbols
+    cleaned_text = re.sub(r'`+', '', cleaned_text)   # Remove backticks
+    cleaned_text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', cleaned_text)  # Remove markdown links
+    cleaned_text = re.sub(r'[^\w\s\u0900-\u097F.,!?।]', ' ', cleaned_text)  # Keep only letters, numbers, spaces, and basic punctuation
+    
+    # Clean punctuation
+    cleaned_text = cleaned_text.replace(',', ' ').replace(';', ' ').replace(':', ' ')
+    return ' '.join(cleaned_text.split())  # Remove extra spaces
+
+# MP3 clip of one sentence, None when nothing is left to say once it is cleaned
+def synthesize_sentence(sentence, language):
+    cleaned_text = clean_for_speech(sentence)
+    if not cleaned_text:
+        return None
+    return synthesize(cleaned_text, language)
+
+# Starts speaking a text a sentence at a time: the sentences are synthesized at the
+# same time and played in order, starting as soon as the first one is ready. Returns
+# None when audio is not available.
+def start_speaking(language="hi"):
+    if not initialize_tts():
+        return None
+    return SentenceSpeech(
+        lambda sentence: synthesize_sentence(sentence, language),
+        speech_player.play,
+        timeout=TTS_TIMEOUT,
+    )
+
+# Speaks text unless its sentences were already added while it streamed in, and
+# waits until every sentence is synthesized. Playback goes on in the background.
+def finish_speaking(speech, text):
+    with speech:
+        if not speech.sentences:
+            for sentence in split_sentences(text):
+                speech.add(sentence)
+        speech.wait()
+    if speech.sentences and speech.failed == speech.sentences:
+        return False, "TTS error: no sentence could be synthesized"
+    return True, None
+
+# Drops the speech of an answer that broke off, including the clips already queued
+# for playback, and returns a fresh one to speak the fallback answer with
+def restart_speaking(speech, language="hi"):
+    if speech is None:
+        return None
+    speech.close()
+    stop_audio()
+    return start_speaking(language)
+
 # Text-to-speech
-def speak_text(text, language="hi", tts_available=False):
+@timed("chatbot.tts")
+def speak_text(text, language="hi"):
     try:
-        if tts_available:
-            # Clean text for better TTS - remove markdown and special characters
-            cleaned_text = text
-            
-            # Remove markdown formatting
-            import re
-            cleaned_text = re.sub(r'\*+', '', cleaned_text)  # Remove asterisks
-            cleaned_text = re.sub(r'#+', '', cleaned_text)   # Remove hash symbols
-            cleaned_text = re.sub(r'`+', '', cleaned_text)   # Remove backticks
-            cleaned_text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', cleaned_text)  # Remove markdown links
-            cleaned_text = re.sub(r'[^\w\s\u0900-\u097F.,!?।]', ' ', cleaned_text)  # Keep only letters, numbers, spaces, and basic punctuation
-            
-            # Clean punctuation
-            cleaned_text = cleaned_text.replace(',', ' ').replace(';', ' ').replace(':', ' ')
-            cleaned_text = ' '.join(cleaned_text.split())  # Remove extra spaces
-            
-            # Limit text length for TTS
-            if len(cleaned_text) > 500:
-                cleaned_text = cleaned_text[:500] + "..."
-            
-            tts = gTTS(text=cleaned_text, lang=language, slow=False)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-                tts.save(tmp_file.name)
-                
-                try:
-                    pygame.mixer.music.load(tmp_file.name)
-                    pygame.mixer.music.play()
-                    # Return the temp file path so we can stop it later
-                    return True, tmp_file.name
-                except Exception as audio_error:
-                    # If audio playback fails, still return success but without playback
-                    st.info("Audio file generated but playback not available in this environment")
-                    return True, tmp_file.name
-        else:
+        speech = start_speaking(language)
+        if speech is None:
             return False, "TTS not available"
+        return finish_speaking(speech, text)
     except Exception as e:
         return False, f"TTS error: {e}"
 
 # Stop audio playback
 def stop_audio():
     try:
-        pygame.mixer.music.stop()
+        speech_player.stop()
         return True
     except Exception as e:
         # Audio may not be available, that's okay
@@ -289,21 +348,15 @@ def main():
             st.session_state.last_processed_audio = None
             st.session_state.last_processed_text = None
             st.session_state.is_playing_audio = False
-            if st.session_state.current_audio_file:
-                try:
-                    os.unlink(st.session_state.current_audio_file)
-                except:
-                    pass
-                st.session_state.current_audio_file = None
+            stop_audio()
             st.rerun()
         
         # Refresh page
         if st.button("🔄 Refresh Page", help="Reload the entire page"):
             st.rerun()
     
-    # Initialize components
-    ai_model = initialize_ai() if use_ai else None
-    tts_available = initialize_tts()
+    # The AI model and the audio mixer are set up when a reply is generated or
+    # spoken, not on every rerun
     
     # Audio controls
     if st.session_state.is_playing_audio:
@@ -312,9 +365,6 @@ def main():
             if st.button("⏹️ Stop Audio", type="secondary"):
                 stop_audio()
                 st.session_state.is_playing_audio = False
-                if st.session_state.current_audio_file and os.path.exists(st.session_state.current_audio_file):
-                    os.unlink(st.session_state.current_audio_file)
-                st.session_state.current_audio_file = None
                 st.rerun()
         with col2:
             st.write("🔊 Playing...")
@@ -338,10 +388,9 @@ def main():
                 if st.button(f"🔊 Speak", key=f"speak_{message['timestamp']}"):
                     # Detect language of the response text
                     response_lang = detect_language(message['text'])
-                    speak_success, speak_result = speak_text(message['text'], response_lang, tts_available)
+                    speak_success, speak_result = speak_text(message['text'], response_lang)
                     if speak_success:
                         st.session_state.is_playing_audio = True
-                        st.session_state.current_audio_file = speak_result
                         st.rerun()
                     else:
                         st.warning(f"TTS Warning: {speak_result}")
@@ -381,14 +430,16 @@ def main():
                 # Detect the language of the transcribed text
                 detected_lang = detect_language(transcribed_text)
                 
-                # Generate AI response in the same language
+                # Generate AI response in the same language, spoken while it streams in
+                speech = start_speaking(detected_lang) if auto_play else None
+                ai_model = initialize_ai() if use_ai else None
                 if use_ai and ai_model:
-                    with st.spinner("Generating AI response..."):
-                        ai_response, ai_error = generate_ai_response(transcribed_text, ai_model, detected_lang)
-                        
-                        if ai_error:
-                            st.error(f"AI Error: {ai_error}")
-                            ai_response = get_fallback_response(transcribed_text, detected_lang)
+                    ai_response, ai_error = generate_ai_response(transcribed_text, ai_model, detected_lang, speech)
+                    
+                    if ai_error:
+                        st.error(f"AI Error: {ai_error}")
+                        ai_response = get_fallback_response(transcribed_text, detected_lang)
+                        speech = restart_speaking(speech, detected_lang)
                 else:
                     ai_response = get_fallback_response(transcribed_text, detected_lang)
                 
@@ -402,10 +453,12 @@ def main():
                 # Speak the response in the detected language
                 if auto_play:
                     with st.spinner("Speaking response..."):
-                        speak_success, speak_result = speak_text(ai_response, detected_lang, tts_available)
+                        if speech is None:
+                            speak_success, speak_result = False, "TTS not available"
+                        else:
+                            speak_success, speak_result = finish_speaking(speech, ai_response)
                         if speak_success:
                             st.session_state.is_playing_audio = True
-                            st.session_state.current_audio_file = speak_result
                         else:
                             st.warning(f"TTS Warning: {speak_result}")
                 
@@ -436,12 +489,14 @@ def main():
             # Detect the language of the input text
             detected_lang = detect_language(user_input)
             
-            # Generate response in the same language
+            # Generate response in the same language, spoken while it streams in
+            speech = start_speaking(detected_lang) if auto_play else None
+            ai_model = initialize_ai() if use_ai else None
             if use_ai and ai_model:
-                with st.spinner("Generating response..."):
-                    response, error = generate_ai_response(user_input, ai_model, detected_lang)
-                    if error:
-                        response = get_fallback_response(user_input, detected_lang)
+                response, error = generate_ai_response(user_input, ai_model, detected_lang, speech)
+                if error:
+                    response = get_fallback_response(user_input, detected_lang)
+                    speech = restart_speaking(speech, detected_lang)
             else:
                 response = get_fallback_response(user_input, detected_lang)
             
@@ -454,10 +509,12 @@ def main():
             
             # Speak response in the detected language
             if auto_play:
-                speak_success, speak_result = speak_text(response, detected_lang, tts_available)
+                if speech is None:
+                    speak_success, speak_result = False, "TTS not available"
+                else:
+                    speak_success, speak_result = finish_speaking(speech, response)
                 if speak_success:
                     st.session_state.is_playing_audio = True
-                    st.session_state.current_audio_file = speak_result
                 else:
                     st.warning(f"TTS Warning: {speak_result}")
             
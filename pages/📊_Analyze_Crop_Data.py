@@ -1,10 +1,51 @@
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+from crop_data import PLOT_ROW_BUDGET, get_crop_data, get_crop_data_version, sample_rows, unique_values
+from crop_index import get_crop_index
+from crop_rollups import get_crop_rollups
+from eda_charts import (
+    correlation_chart,
+    density_chart,
+    density_table,
+    scatter_chart,
+    season_box_chart,
+    state_count_chart,
+    yield_chart,
+)
+from figure_cache import figure_cache
+from instrumentation import debug_panel
+from lazy_imports import lazy_import
+
+# seaborn is only needed for the pair plot, and only when it is not cached
+sns = lazy_import("seaborn")
 
 st.set_page_config(page_title="Crop Data Analysis", page_icon=":bar_chart:")
-df = pd.read_csv("crop_production.csv")
+debug_panel()
+df = get_crop_data()
+index = get_crop_index()
+rollups = get_crop_rollups()
+data_version = get_crop_data_version()
+crop_options = unique_values(df, "Crop")
+season_options = unique_values(df, "Season")
+growing_seasons = [season for season in season_options if season != "Whole Year"]
+
+# The pair plot and scatter plot draw every row, so above this many rows they are
+# drawn from a stratified sample (or as a density) to keep their cost bounded
+row_budget = st.sidebar.number_input(
+    "Plot row budget",
+    min_value=100,
+    max_value=100000,
+    value=PLOT_ROW_BUDGET,
+    step=500,
+    help="Largest number of rows the pair plot and scatter plot draw",
+)
+
+
+# Shows a figure from the figure cache. draw is only called when this plot type and
+# selection have not been rendered for the current data yet.
+def show_figure(plot_type, selection, draw):
+    image = figure_cache.render((plot_type, selection, data_version), draw)
+    st.image(image, use_container_width=True)
+
 
 st.title("Exploratory Data Analysis")
 st.write(df.head())
@@ -12,44 +53,29 @@ st.write(df.head())
 # Containers
 st.header("Summary Statistics")
 with st.container():
-    st.write(df.describe())
+    st.write(rollups.summary())
 
+# The charts below are drawn in the browser from the pre-aggregated rollup tables,
+# sent only for the selected crop, so hovering them needs no rerun
 st.header("Correlation Matrix")
 with st.container():
-    corr = df.corr(numeric_only=True)
-    fig, ax = plt.subplots()
-    sns.heatmap(corr, annot=True, ax=ax, cmap="coolwarm")
-    st.pyplot(fig)
+    st.altair_chart(correlation_chart(rollups.correlation()), use_container_width=True)
 
 st.header("Crop Distribution")
-selected_crop = st.selectbox("Select Crop for Distribution", df["Crop"].unique())
 with st.container():
-    filtered_df = df[df["Crop"] == selected_crop]
-    fig, ax = plt.subplots()
-    sns.countplot(
-        data=filtered_df,
-        x="State_Name",
-        order=filtered_df["State_Name"].value_counts().index,
-        ax=ax,
+    distribution_crop = st.selectbox("Select Crop for Distribution", crop_options)
+    st.altair_chart(
+        state_count_chart(rollups.state_counts(distribution_crop), distribution_crop),
+        use_container_width=True,
     )
-    ax.set_title(f"Distribution of {selected_crop} across States")
-    ax.set_xlabel("States")
-    ax.set_ylabel("Count")
-    plt.setp(ax.get_xticklabels(), rotation=45)
-    st.pyplot(fig)
 
 st.header("Production by Season")
-selected_crop_season = st.selectbox(
-    "Select Crop for Production by Season", df["Crop"].unique()
-)
 with st.container():
-    filtered_df = df[
-        (df["Crop"] == selected_crop_season) & (df["Season"] != "Whole Year")
-    ]
-    fig, ax = plt.subplots()
-    sns.boxplot(x="Season", y="Production", data=filtered_df, ax=ax)
-    ax.set_title(f"Production by Season for {selected_crop_season}")
-    st.pyplot(fig)
+    season_crop = st.selectbox("Select Crop for Production by Season", crop_options)
+    st.altair_chart(
+        season_box_chart(rollups.season_stats(season_crop, seasons=growing_seasons), season_crop),
+        use_container_width=True,
+    )
 
 
 # st.header("Production by Crop Type")
@@ -62,35 +88,52 @@ with st.container():
 
 st.header("Pair Plots by Crop and Season")
 with st.container():
-    selected_crop = st.selectbox("Select Crop for Pair Plot", df["Crop"].unique())
-    selected_season = st.selectbox("Select Season for Pair Plot", df["Season"].unique())
-    filtered_df = df[(df["Crop"] == selected_crop) & (df["Season"] == selected_season)]
+    selected_crop = st.selectbox("Select Crop for Pair Plot", crop_options)
+    selected_season = st.selectbox("Select Season for Pair Plot", season_options)
+    filtered_df = index.select(Crop=selected_crop, Season=selected_season)
 
     if not filtered_df.empty:
-        fig = sns.pairplot(filtered_df)
-        st.pyplot(fig)
+        sample_df = sample_rows(filtered_df, row_budget, stratify="State_Name")
+        if len(sample_df) < len(filtered_df):
+            st.caption(f"Showing a sample of {len(sample_df):,} of {len(filtered_df):,} rows, stratified by state.")
+        # keyed on the rows drawn rather than the budget, so every budget at or above
+        # the row count shares one figure. Below it the budget picks the sample.
+        show_figure(
+            "pairplot",
+            (selected_crop, selected_season, min(row_budget, len(filtered_df))),
+            lambda: sns.pairplot(sample_df),
+        )
     else:
         st.write("No data available for the selected crop and season.")
 
 st.header("Production vs Area")
 with st.container():
-    crop_selected = st.selectbox("Select Crop for Scatter Plot", df["Crop"].unique())
-    filtered_df = df[(df["Crop"] == crop_selected)]
-    filtered_df = df[(df["Season"] != "Whole Year")]
-    fig, ax = plt.subplots()
-    sns.scatterplot(x="Area", y="Production", data=filtered_df, hue="Season", ax=ax)
-    ax.set_title(f"Production vs Area for {crop_selected}")
-    st.pyplot(fig)
+    crop_selected = st.selectbox("Select Crop for Scatter Plot", crop_options)
+    filtered_df = index.select(Crop=crop_selected, Season=growing_seasons)
+    over_budget = len(filtered_df) > row_budget
+    scatter_mode = "Points"
+    sample_df = filtered_df
+    if over_budget:
+        scatter_mode = st.radio(
+            "Render mode", ["Sampled points", "Density"], horizontal=True
+        )
+        if scatter_mode == "Sampled points":
+            sample_df = sample_rows(filtered_df, row_budget, stratify="Season")
+            st.caption(f"Showing a sample of {len(sample_df):,} of {len(filtered_df):,} rows, stratified by season.")
+        else:
+            st.caption(f"Showing the density of all {len(filtered_df):,} rows.")
+
+    title = f"Production vs Area for {crop_selected}"
+    if scatter_mode == "Density":
+        chart = density_chart(density_table(filtered_df), title)
+    else:
+        chart = scatter_chart(sample_df, unique_values(filtered_df, "Season"), title)
+    st.altair_chart(chart, use_container_width=True)
 
 st.header("Yield Analysis")
-selected_crop_yield = st.selectbox(
-    "Select Crop for Yield Analysis", df["Crop"].unique()
-)
 with st.container():
-    filtered_df = df[df["Crop"] == selected_crop_yield].copy()
-    filtered_df["Yield"] = filtered_df["Production"] / filtered_df["Area"]
-    fig, ax = plt.subplots()
-    sns.histplot(filtered_df["Yield"], kde=True, ax=ax)
-    ax.set_title(f"Yield Distribution for {selected_crop_yield}")
-    ax.set_xlabel("Yield (Production per unit area)")
-    st.pyplot(fig)
+    yield_crop = st.selectbox("Select Crop for Yield Analysis", crop_options)
+    st.altair_chart(
+        yield_chart(rollups.yield_histogram(yield_crop), rollups.yield_kde(yield_crop), yield_crop),
+        use_container_width=True,
+    )
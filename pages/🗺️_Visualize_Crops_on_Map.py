@@ -1,165 +1,102 @@
 import streamlit as st
-import pandas as pd
-import pydeck as pdk
-import os
-from lat_long_finder import generate_lat_lon_csv
-
-# Define the folder name
-folder_name = "State Files"
-
-# Check if the folder exists
-if not os.path.exists(folder_name):
-    # Create the folder
-    os.makedirs(folder_name)
-    print(f"Folder '{folder_name}' created.")
-else:
-    print(f"Folder '{folder_name}' already exists.")
+from lat_long_finder import start_background_refresh
+from crop_data import get_crop_data, unique_values
+from coordinate_resolver import get_state_map
+from map_layers import build_layer_data, compact_layer_data
+from map_tiles import INDIA_CENTER, get_state_centre, national_layer_data
+from instrumentation import debug_panel, timed
+from lazy_imports import lazy_import
+
+# Only the map actually drawn is imported: pydeck for a single year, altair for
+# the year animation
+pdk = lazy_import("pydeck")
+alt = lazy_import("altair")
 
-df = pd.read_csv("crop_production.csv")
+df = get_crop_data()
 
 st.set_page_config("Map", page_icon="🗺️")
+debug_panel()
 st.title("Crop Geographical Data")
 
+# How the national map describes and draws each level of detail
+LEVEL_LABELS = {"state": "states", "grid": "grid cells", "district": "districts"}
+LEVEL_STYLES = {
+    "state": {"scale": 0.05, "column_radius": 25000, "name_label": "State"},
+    "grid": {"scale": 0.3, "column_radius": 10000, "name_label": "Grid cell"},
+    "district": {"scale": 1.0, "column_radius": 3000, "name_label": "District"},
+}
+
 # Sidebar filters with default values
 with st.sidebar:
     st.write("# Filter Data")
     
     # Get unique values
-    states = df["State_Name"].unique()
-    years = df["Crop_Year"].unique()
-    crops = df["Crop"].unique()
-    seasons = df["Season"].unique()
+    states = unique_values(df, "State_Name")
+    years = unique_values(df, "Crop_Year")
+    crops = unique_values(df, "Crop")
+    seasons = unique_values(df, "Season")
     
     # Set default to Maharashtra (which has coordinate data)
     maharashtra_index = 0
     if "Maharashtra" in states:
-        maharashtra_index = list(states).index("Maharashtra")
+        maharashtra_index = states.index("Maharashtra")
     
     # Set default to 2004 (which has data)
     year_2004_index = 0
     if 2004 in years:
-        year_2004_index = list(years).index(2004)
+        year_2004_index = years.index(2004)
     
     # Set default to Rice (which has data)
     rice_index = 0
     if "Rice" in crops:
-        rice_index = list(crops).index("Rice")
+        rice_index = crops.index("Rice")
     
     # Set default to Kharif (which has data)
     kharif_index = 0
     if "Kharif" in seasons:
-        kharif_index = list(seasons).index("Kharif")
+        kharif_index = seasons.index("Kharif")
     
-    state = st.selectbox("Select State: ", states, index=maharashtra_index)
-    crop_year = st.selectbox("Select Crop Year:", years, index=year_2004_index)
+    map_scope = st.radio("Map scope:", ["Single state", "All India"], horizontal=True)
+    animate = False
+    if map_scope == "Single state":
+        state = st.selectbox("Select State: ", states, index=maharashtra_index)
+        animate = st.checkbox("Animate over the years", help="Scrub through every year on the map itself")
+    else:
+        focus = st.selectbox("Centre map on:", ["All India"] + states)
+        zoom = st.slider("Zoom:", min_value=4.0, max_value=8.0, value=4.0, step=0.5)
+    if not animate:
+        crop_year = st.selectbox("Select Crop Year:", years, index=year_2004_index)
     crop = st.selectbox("Select Crop:", crops, index=rice_index)
     season = st.selectbox("Select Season:", seasons, index=kharif_index)
 
-lat_lon_file = f"State Files/lat_lon_{'_'.join(word for word in state.split())}.csv"
-
-# If the file doesn't exist, then generate the latitude and longitude coordinates
-# of the districts by calling the generate_lat_lon_csv from the lat_long_finder script
-if not os.path.isfile(lat_lon_file):
-    generate_lat_lon_csv(state)
-
-lat_lon_df = pd.read_csv(lat_lon_file)
-df = df[df["State_Name"] == state]
 
-# Check if coordinates are missing and provide fallback
-if lat_lon_df["lat"].isna().all() or lat_lon_df["lon"].isna().all():
-    st.warning(f"⚠️ Coordinates not available. Using approximate coordinates for {state} districts.")
-    
-    # Fallback coordinates for different states
-    state_coords = {
-        'Maharashtra': {
-            'AHMEDNAGAR': [19.0952, 74.7496],
-            'AKOLA': [20.7006, 77.0086],
-            'AMRAVATI': [20.9374, 77.7796],
-            'AURANGABAD': [19.8762, 75.3433],
-            'BEED': [18.9894, 75.7564],
-            'BHANDARA': [21.1702, 79.6539],
-            'BULDHANA': [20.5313, 76.1829],
-            'CHANDRAPUR': [19.9615, 79.2961],
-            'DHULE': [20.9013, 74.7774],
-            'GADCHIROLI': [20.1806, 80.0039],
-            'GONDIA': [21.4602, 80.1920],
-            'HINGOLI': [19.7146, 77.1424],
-            'JALGAON': [21.0077, 75.5626],
-            'JALNA': [19.8410, 75.8864],
-            'KOLHAPUR': [16.7050, 74.2433],
-            'LATUR': [18.4088, 76.5604],
-            'MUMBAI': [19.0760, 72.8777],
-            'NAGPUR': [21.1458, 79.0882],
-            'NANDED': [19.1383, 77.3210],
-            'NANDURBAR': [21.3707, 74.2409],
-            'NASHIK': [19.9975, 73.7898],
-            'OSMANABAD': [18.1814, 76.0419],
-            'PALGHAR': [19.6969, 72.7654],
-            'PARBHANI': [19.2460, 76.4408],
-            'PUNE': [18.5204, 73.8567],
-            'RAIGAD': [18.5158, 73.1829],
-            'RATNAGIRI': [16.9944, 73.3002],
-            'SANGLI': [16.8524, 74.5815],
-            'SATARA': [17.6805, 74.0183],
-            'SINDHUDURG': [16.3615, 73.4004],
-            'SOLAPUR': [17.6599, 75.9064],
-            'THANE': [19.2183, 72.9781],
-            'WARDHA': [20.7453, 78.6022],
-            'WASHIM': [20.1110, 77.1330],
-            'YAVATMAL': [20.4009, 78.1339]
-        },
-        'Andaman and Nicobar Islands': {
-            'NICOBARS': [7.1395, 93.7947],
-            'NORTH AND MIDDLE ANDAMAN': [12.9044, 92.9396],
-            'SOUTH ANDAMANS': [11.7401, 92.6586]
-        }
-    }
-    
-    # Update the lat_lon_df with fallback coordinates
-    if state in state_coords:
-        for idx, row in lat_lon_df.iterrows():
-            district = row['District_Name']
-            if district in state_coords[state]:
-                lat_lon_df.at[idx, 'lat'] = state_coords[state][district][0]
-                lat_lon_df.at[idx, 'lon'] = state_coords[state][district][1]
-    else:
-        st.error(f"❌ No coordinate data available for {state}. Please select Maharashtra or Andaman and Nicobar Islands.")
-        st.stop()
-
-# Merge the dataframes on the District_Name key
-df = pd.merge(df, lat_lon_df, on="District_Name")
-
-# Filter dataframe based on user selections
-filtered_df = df[
-    (df["Crop_Year"] == crop_year) & (df["Crop"] == crop) & (df["Season"] == season)
-]
-
-# Remove rows with missing coordinates
-filtered_df = filtered_df.dropna(subset=['lat', 'lon'])
-
-if filtered_df.empty:
-    st.error("❌ No data available for the selected filters.")
-    st.info("💡 Try different filter combinations.")
-else:
+# Draws the area and production layers for the given layer data. scale shrinks the
+# circles and columns of aggregated points, which carry much larger totals, and
+# name_label says in the tooltip what the District_Name column of a point names.
+@timed("map.render")
+def render_map(layer_data, latitude, longitude, zoom, scale=1.0, column_radius=3000, name_label="District"):
     st.write("**Filtered Data:**")
-    st.write(filtered_df[['District_Name', 'Area', 'Production', 'lat', 'lon']])
+    st.write(layer_data[['District_Name', 'Area', 'Production', 'lat', 'lon']].rename(columns={'District_Name': name_label}))
+    # the table shows the exact totals, the layers only need rounded ones
+    layer_data = compact_layer_data(layer_data)
 
     # Pydeck map visualization
     st.write("**🗺️ Interactive Map:**")
     
     view_state = pdk.ViewState(
-        latitude=filtered_df["lat"].mean(),
-        longitude=filtered_df["lon"].mean(),
-        zoom=6,
+        latitude=latitude,
+        longitude=longitude,
+        zoom=zoom,
         pitch=50,
     )
 
     # Pydeck Layer for showing cultivation area of each district
     area_layer = pdk.Layer(
         "ScatterplotLayer",
-        data=filtered_df,
+        data=layer_data,
         get_position=["lon", "lat"],
         get_radius="Area * 0.3",
+        radius_scale=scale,
         get_fill_color=[0, 0, 255, 100],
         pickable=True,
         auto_highlight=True,
@@ -168,10 +105,11 @@ else:
     # Pydeck Layer for showing production of each district
     production_layer = pdk.Layer(
         "ColumnLayer",
-        data=filtered_df,
-        radius=3000,
+        data=layer_data,
+        radius=column_radius,
         get_position=["lon", "lat"],
         get_elevation="Production * 5",
+        elevation_scale=scale,
         get_fill_color=[255, 0, 0, 100],
         pickable=True,
         auto_highlight=True,
@@ -179,7 +117,7 @@ else:
 
     # Tooltip for pickable attribute
     tooltip = {
-        "html": "District: <b>{District_Name}</b><br/>Production: <b>{Production}</b><br/>Area: <b>{Area}</b>",
+        "html": name_label + ": <b>{District_Name}</b><br/>Production: <b>{Production}</b><br/>Area: <b>{Area}</b>",
         "style": {
             "background": "grey",
             "color": "white",
@@ -199,3 +137,101 @@ else:
     )
     
     st.info("💡 **Map Legend:** Blue circles show cultivation area, Red columns show production volume. Click on markers for details.")
+
+
+# Draws the district totals of every year with a year slider on the chart. All
+# years are sent at once and the slider filters them in the browser, so scrubbing
+# through the years never goes back to the server.
+@timed("map.render_year_animation")
+def render_year_animation(year_frames):
+    st.write("**🗺️ Crops Over The Years:**")
+    first_year, last_year = int(year_frames["Crop_Year"].min()), int(year_frames["Crop_Year"].max())
+    year = alt.param(
+        name="year",
+        value=first_year,
+        bind=alt.binding_range(min=first_year, max=last_year, step=1, name="Crop Year "),
+    )
+
+    # Fixed scales over all years, so the circles of different years compare
+    districts = (
+        alt.Chart(year_frames)
+        .mark_circle(opacity=0.7, stroke="black", strokeWidth=0.5)
+        .encode(
+            longitude="lon:Q",
+            latitude="lat:Q",
+            size=alt.Size("Area:Q", scale=alt.Scale(domain=[0, int(year_frames["Area"].max())], range=[10, 1500])),
+            color=alt.Color(
+                "Production:Q",
+                scale=alt.Scale(scheme="reds", domain=[0, int(year_frames["Production"].max())]),
+            ),
+            tooltip=["District_Name", "Crop_Year", "Area", "Production"],
+        )
+        .add_params(year)
+        .transform_filter(alt.datum.Crop_Year == year)
+        .project("mercator")
+        .properties(height=500)
+    )
+    st.altair_chart(districts, use_container_width=True)
+    st.info("💡 **Map Legend:** Circle size shows cultivation area, colour shows production volume. Drag the Crop Year slider below the map to move through the years.")
+
+
+if map_scope == "All India":
+    # Only districts that are already stored or in the packaged coordinate table are
+    # shown. The table is filled for every state with `lat_long_finder.py --build`.
+
+    # Level of detail: state totals when zoomed out, then a grid and finally single
+    # districts, always limited to the part of the country that is in view
+    if focus == "All India":
+        latitude, longitude = INDIA_CENTER
+    else:
+        latitude, longitude = get_state_centre(focus)
+    level, layer_data = national_layer_data(crop_year, crop, season, latitude, longitude, zoom)
+
+    if layer_data.empty:
+        st.error("❌ No data available for the selected filters in this view.")
+        st.info("💡 Try different filter combinations, zoom out or centre the map elsewhere.")
+    else:
+        st.caption(f"Showing {len(layer_data)} {LEVEL_LABELS[level]}.")
+        render_map(layer_data, latitude, longitude, zoom, **LEVEL_STYLES[level])
+    st.stop()
+
+state_map = get_state_map(state)
+
+# Districts without coordinates are geocoded on a background thread by the
+# lat_long_finder script, so the map never waits for the geocoding API
+if state_map.unlocated_districts:
+    start_background_refresh([state])
+
+if state_map.coordinates["lat"].isna().all():
+    st.error(f"❌ No coordinate data available for {state} yet. It is being fetched in the background, please check back shortly or select Maharashtra or Andaman and Nicobar Islands.")
+    st.stop()
+elif state_map.filled_districts:
+    st.warning(f"⚠️ Coordinates not available. Using approximate coordinates for {len(state_map.filled_districts)} {state} districts: {', '.join(state_map.filled_districts)}.")
+
+if animate:
+    year_frames = state_map.year_frames(crop, season)
+    if year_frames.empty:
+        st.error("❌ No data available for the selected filters.")
+        st.info("💡 Try different filter combinations.")
+    else:
+        st.caption(f"{year_frames['Crop_Year'].nunique()} years of data for {year_frames['District_Name'].nunique()} districts.")
+        render_year_animation(year_frames)
+    st.stop()
+
+# Look up the rows for the user selections in the state's index, which already
+# carries the coordinates of every district
+filtered_df = state_map.index.select(Crop_Year=crop_year, Crop=crop, Season=season)
+
+if filtered_df.empty:
+    st.error("❌ No data available for the selected filters.")
+    st.info("💡 Try different filter combinations.")
+else:
+    # Only the aggregated district totals with the columns the layers need are sent
+    # to the browser, instead of every matching row with all its columns
+    layer_data = build_layer_data(filtered_df)
+    render_map(
+        layer_data,
+        latitude=float(layer_data["lat"].mean()),
+        longitude=float(layer_data["lon"].mean()),
+        zoom=6,
+    )
@@ -1,162 +1,45 @@
 import streamlit as st
 import pandas as pd
-from lat_long_finder import generate_lat_lon_csv
-import joblib
+from crop_data import get_crop_data, unique_values
+from crop_index import get_crop_index
+from crop_prediction import (
+    FEATURE_COLUMNS,
+    ENCODED_COLUMNS,
+    encode_features,
+    msp_values,
+    predict_batch,
+    prediction_cache,
+)
+from instrumentation import debug_panel
+from model_registry import registry
 
 st.set_page_config("ML Model", page_icon="🤖")
+debug_panel()
 
-# MSP values dictionary for revenue calculation
-msp_values = {
-    "Arecanut": None,
-    "Other Kharif pulses": None,
-    "Rice": 2300,
-    "Banana": None,
-    "Cashewnut": None,
-    "Coconut": None,
-    "Dry ginger": None,
-    "Sugarcane": 340,
-    "Sweet potato": None,
-    "Tapioca": None,
-    "Black pepper": None,
-    "Dry chillies": None,
-    "other oilseeds": None,
-    "Turmeric": None,
-    "Maize": 2225,
-    "Moong(Green Gram)": 8682,
-    "Urad": 7400,
-    "Arhar/Tur": 7550,
-    "Groundnut": 6783,
-    "Sunflower": 7280,
-    "Bajra": 2500,
-    "Castor seed": None,
-    "Cotton(lint)": 7121,
-    "Horse-gram": None,
-    "Jowar": 3371,
-    "Korra": None,
-    "Ragi": 4290,
-    "Tobacco": None,
-    "Gram": 5335,
-    "Wheat": 2125,
-    "Masoor": 6000,
-    "Sesamum": 7307,
-    "Linseed": None,
-    "Safflower": 5215,
-    "Onion": None,
-    "other misc. pulses": None,
-    "Samai": None,
-    "Small millets": None,
-    "Coriander": None,
-    "Potato": None,
-    "Other Rabi pulses": None,
-    "Soyabean": 4892,
-    "Beans & Mutter(Vegetable)": None,
-    "Bhindi": None,
-    "Brinjal": None,
-    "Citrus Fruit": None,
-    "Cucumber": None,
-    "Grapes": None,
-    "Mango": None,
-    "Orange": None,
-    "other fibres": None,
-    "Other Fresh Fruits": None,
-    "Other Vegetables": None,
-    "Papaya": None,
-    "Pome Fruit": None,
-    "Tomato": None,
-    "Rapeseed & Mustard": 5450,
-    "Mesta": None,
-    "Cowpea(Lobia)": None,
-    "Lemon": None,
-    "Pome Granet": None,
-    "Sapota": None,
-    "Cabbage": None,
-    "Peas (vegetable)": None,
-    "Niger seed": 6930,
-    "Bottle Gourd": None,
-    "Sannhamp": None,
-    "Varagu": None,
-    "Garlic": None,
-    "Ginger": None,
-    "Oilseeds total": None,
-    "Pulses total": None,
-    "Jute": 4450,
-    "Peas & beans (Pulses)": None,
-    "Blackgram": None,
-    "Paddy": 1868,
-    "Pineapple": None,
-    "Barley": 1600,
-    "Khesari": None,
-    "Guar seed": None,
-    "Moth": None,
-    "Other Cereals & Millets": None,
-    "Cond-spcs other": None,
-    "Turnip": None,
-    "Carrot": None,
-    "Redish": None,
-    "Arcanut (Processed)": None,
-    "Atcanut (Raw)": None,
-    "Cashewnut Processed": None,
-    "Cashewnut Raw": None,
-    "Cardamom": None,
-    "Rubber": None,
-    "Bitter Gourd": None,
-    "Drum Stick": None,
-    "Jack Fruit": None,
-    "Snak Guard": None,
-    "Pump Kin": None,
-    "Tea": None,
-    "Coffee": None,
-    "Cauliflower": None,
-    "Other Citrus Fruit": None,
-    "Water Melon": None,
-    "Total foodgrain": None,
-    "Kapas": None,
-    "Colocosia": None,
-    "Lentil": None,
-    "Bean": None,
-    "Jobster": None,
-    "Perilla": None,
-    "Rajmash Kholar": None,
-    "Ricebean (nagadal)": None,
-    "Ash Gourd": None,
-    "Beet Root": None,
-    "Lab-Lab": None,
-    "Ribed Guard": None,
-    "Yam": None,
-    "Apple": None,
-    "Peach": None,
-    "Pear": None,
-    "Plums": None,
-    "Litchi": None,
-    "Ber": None,
-    "Other Dry Fruit": None,
-    "Jute & mesta": None,
-}
-
-df = pd.read_csv("crop_production.csv")
-model = joblib.load("model2.pkl")
-label_encoders = joblib.load("label_encoders2.pkl")
+df = get_crop_data()
 
 
 st.title("Maharashtra Crop Yield Prediction")
 
 # Set default values for better user experience
-maharashtra_districts = df[df["State_Name"] == "Maharashtra"]["District_Name"].unique()
-crops = df["Crop"].unique()
-seasons = df["Season"].unique()
+maharashtra_districts = unique_values(
+    get_crop_index().select(State_Name="Maharashtra"), "District_Name"
+)
+crops = unique_values(df, "Crop")
+seasons = unique_values(df, "Season")
 
 # Set default indices
 pune_index = 0
 if "PUNE" in maharashtra_districts:
-    pune_index = list(maharashtra_districts).index("PUNE")
+    pune_index = maharashtra_districts.index("PUNE")
 
 rice_index = 0
 if "Rice" in crops:
-    rice_index = list(crops).index("Rice")
+    rice_index = crops.index("Rice")
 
 kharif_index = 0
 if "Kharif" in seasons:
-    kharif_index = list(seasons).index("Kharif")
+    kharif_index = seasons.index("Kharif")
 
 district = st.selectbox("District name", maharashtra_districts, index=pune_index)
 crop = st.selectbox("Crop", crops, index=rice_index)
@@ -172,24 +55,12 @@ input_data = pd.DataFrame(
     }
 )
 
-# Debug: Check input data before encoding
-# st.write("Input Data before encoding:", input_data)
-
-# Preprocessing the input data
-for column in ["District_Name", "Season", "Crop"]:
-    if column in label_encoders:
-        le = label_encoders[column]
-        try:
-            input_data[column] = le.transform(input_data[column])
-            n = 0
-        except ValueError:
-            st.write("Crop not grown in this district")
-            n = 1
-
-    # input_data[column] = label_encoders.transform(input_data[column])
-
-# Debug: Check input data after encoding
-# st.write("Input Data after encoding:", input_data)
+# Check that the model has seen this district, season and crop before
+_, unknown = encode_features(input_data)
+unknown_columns = [column for column in ENCODED_COLUMNS if unknown[column].iloc[0]]
+n = 1 if unknown_columns else 0
+if n == 1:
+    st.write(f"Crop not grown in this district (unknown {', '.join(unknown_columns)})")
 
 # Initialize session state for results
 if 'yield_result' not in st.session_state:
@@ -202,17 +73,17 @@ if n != 1:
     
     with col1:
         if st.button("Predict Yield in Kilotons"):
-            predictions = model.predict(input_data)
-            st.session_state.yield_result = f"Predicted Production: {predictions[0]:.2f} kilotons"
+            prediction = predict_batch(input_data).iloc[0]
+            st.session_state.yield_result = f"Predicted Production: {prediction['Predicted_Production']:.2f} kilotons"
             st.session_state.revenue_result = None  # Clear revenue when yield is clicked
     
     with col2:
         if st.button("Predict Revenue"):
             if crop in msp_values and msp_values[crop] is not None:
-                predicted_production = model.predict(input_data)
-                msp = msp_values[crop] * predicted_production * 10000
+                # Reuses the cached production if the yield was already predicted for these inputs
+                prediction = predict_batch(input_data).iloc[0]
                 # Format with commas
-                formatted_revenue = f"{msp[0]:,.2f}"
+                formatted_revenue = f"{prediction['Predicted_Revenue']:,.2f}"
                 st.session_state.revenue_result = f"Predicted Revenue: ₹{formatted_revenue}"
                 st.session_state.yield_result = None  # Clear yield when revenue is clicked
             elif crop in msp_values and msp_values[crop] is None:
@@ -283,6 +154,33 @@ if n != 1:
             st.success(st.session_state.revenue_result)
 
 
-# MSP values dictionary is now defined at the top of the file
+# Score many scenarios at once, e.g. every crop and season for a district
+st.subheader("📄 Batch Predictions")
+uploaded_file = st.file_uploader(
+    "Upload a CSV with District_Name, Season, Crop and Area columns", type="csv"
+)
+if uploaded_file is not None:
+    scenarios = pd.read_csv(uploaded_file)
+    missing_columns = [column for column in FEATURE_COLUMNS if column not in scenarios]
+    if missing_columns:
+        st.error(f"❌ The CSV is missing the columns: {', '.join(missing_columns)}")
+    else:
+        predictions = predict_batch(scenarios)
+        st.write(predictions)
+        if not predictions["Known"].all():
+            st.warning(f"⚠️ {(~predictions['Known']).sum()} rows use a district, season or crop the model has not seen.")
+        st.download_button(
+            "Download predictions",
+            predictions.to_csv(index=False),
+            file_name="predictions.csv",
+            mime="text/csv",
+        )
 
-# Revenue prediction is now handled above with the yield prediction
+with st.expander("⚙️ Model Stats"):
+    for stats in registry.stats():
+        resident_mb = "n/a" if stats["resident_bytes"] is None else f"{stats['resident_bytes'] / 2**20:.1f} MB"
+        load_time = "not loaded" if stats["load_seconds"] is None else f"{stats['load_seconds']:.2f} s"
+        st.write(f"**{stats['name']}** ({stats['path']}): load time {load_time}, resident size {resident_mb}")
+        if stats["warm_up_seconds"] is not None:
+            st.write(f"Warm-up prediction: {stats['warm_up_seconds'] * 1000:.1f} ms")
+    st.write("Prediction cache:", prediction_cache.info())
@@ -0,0 +1,166 @@
+import logging
+import queue
+import threading
+import time
+from io import BytesIO
+
+from instrumentation import timed
+from lazy_imports import lazy_import
+from llm_stream import SentenceSplitter
+from speech_cache import speech_cache
+from stage_pipeline import Pipeline, Stage
+
+gtts = lazy_import("gtts")
+pygame = lazy_import("pygame")
+
+# Sentences synthesized at the same time
+TTS_WORKERS = 4
+# How often the player checks whether the current clip has finished, in seconds
+PLAYER_POLL_SECONDS = 0.1
+
+
+# The sentences of a complete text, to speak it one sentence at a time
+def split_sentences(text):
+    splitter = SentenceSplitter()
+    return [sentence.strip() for sentence in splitter.feed(text) + splitter.flush()]
+
+
+# MP3 bytes of text spoken in language, from the speech cache when the same text was
+# spoken before. gTTS cuts long text into pieces of its own, so there is no limit on
+# the length.
+@timed("tts.synthesize")
+def synthesize(text, language):
+    return speech_cache.fetch(text, language, _gtts)
+
+
+@timed("tts.gtts")
+def _gtts(text, language):
+    audio = BytesIO()
+    gtts.gTTS(text=text, lang=language, slow=False).write_to_fp(audio)
+    return audio.getvalue()
+
+
+# Length of the ID3v2 tag at the start of an MP3 clip, 0 when it has none
+def _id3_length(clip):
+    if len(clip) < 10 or clip[:3] != b"ID3":
+        return 0
+    # the size is stored in 4 bytes of 7 bits each and excludes the 10 byte header,
+    # and the footer that flag 0x10 announces
+    size = (clip[6] << 21) | (clip[7] << 14) | (clip[8] << 7) | clip[9]
+    return 10 + size + (10 if clip[5] & 0x10 else 0)
+
+
+# One MP3 of several clips spoken one after another. MP3 frames can simply follow
+# each other, only the ID3 tags of the later clips are dropped so players do not
+# stop at them.
+def join_clips(clips):
+    clips = [clip for clip in clips if clip]
+    if not clips:
+        return b""
+    return clips[0] + b"".join(clip[_id3_length(clip):] for clip in clips[1:])
+
+
+# Hands out values that arrive in any order in the order of their index. put returns
+# the values that are now next in line, nothing while one before them is missing.
+class InOrder:
+    def __init__(self):
+        self._waiting = {}
+        self._next = 0
+
+    def put(self, index, value):
+        self._waiting[index] = value
+        released = []
+        while self._next in self._waiting:
+            released.append(self._waiting.pop(self._next))
+            self._next += 1
+        return released
+
+
+# Speaks a text a sentence at a time. The sentences are synthesized at the same time
+# and each clip is handed to on_clip in sentence order as soon as it and every
+# sentence before it are done, so playback starts after the first sentence.
+# Sentences can be added while earlier ones are synthesized, e.g. while an answer
+# streams in. on_clip runs on the thread that calls poll or wait, and gets None for a
+# sentence that could not be synthesized.
+class SentenceSpeech:
+    def __init__(self, synthesize, on_clip, timeout=None, max_workers=TTS_WORKERS):
+        self._synthesize = synthesize
+        self._on_clip = on_clip
+        self._timeout = timeout
+        self._order = InOrder()
+        self._pipeline = Pipeline(max_workers=max_workers)
+        self.sentences = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, sentence):
+        if not sentence.strip():
+            return
+        self._pipeline.add(Stage(str(self.sentences), lambda: self._synthesize(sentence), timeout=self._timeout))
+        self.sentences += 1
+
+    def _handle(self, result):
+        if not result.ok:
+            self.failed += 1
+            logging.warning(f"Could not synthesize sentence {result.name}: {result.status} {result.error or ''}")
+        for clip in self._order.put(int(result.name), result.value if result.ok else None):
+            self._on_clip(clip)
+
+    # Hands out the clips that are ready, without waiting
+    def poll(self):
+        for result in self._pipeline.poll():
+            self._handle(result)
+
+    # Hands out every remaining clip
+    def wait(self):
+        self._pipeline.wait(on_result=self._handle)
+
+    def close(self):
+        self._pipeline.close()
+
+
+# Plays MP3 clips one after another on the pygame mixer, from a background thread so
+# the page can go on while it speaks. The mixer is process wide, so there is one
+# player per process, speech_player. The caller sets the mixer up.
+class SpeechPlayer:
+    def __init__(self):
+        self._clips = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        # bumped by stop, clips queued before it are dropped
+        self._generation = 0
+
+    def play(self, clip):
+        if not clip:
+            return
+        with self._lock:
+            self._clips.put((self._generation, clip))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="speech-player", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._generation += 1
+        pygame.mixer.music.stop()
+
+    def _run(self):
+        while True:
+            generation, clip = self._clips.get()
+            if generation != self._generation:
+                continue
+            try:
+                pygame.mixer.music.load(BytesIO(clip), "mp3")
+                pygame.mixer.music.play()
+                while pygame.mixer.music.get_busy() and generation == self._generation:
+                    time.sleep(PLAYER_POLL_SECONDS)
+            except Exception as e:
+                logging.error(f"Could not play speech clip: {e}")
+
+
+speech_player = SpeechPlayer()
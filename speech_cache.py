@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import closing
+
+# Inside the cache folder of crop_data, which is not imported so the chatbot pages
+# do not load pandas
+SPEECH_CACHE_FOLDER = os.path.join(".data_cache", "speech")
+SPEECH_INDEX_FILE = "index.sqlite3"
+# Clips are evicted least recently used first once they take more than this
+SPEECH_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# Unindexed files younger than this may belong to a write still in progress and are
+# left alone
+ORPHAN_GRACE_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    key TEXT PRIMARY KEY,
+    language TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+# Texts that only differ in Unicode form or whitespace sound the same
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def clip_key(text, language):
+    return hashlib.sha256(f"{language}\n{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+# Disk cache of synthesized speech, keyed on (normalized text, language). Every clip
+# is an MP3 file named after the hash of its key, next to a SQLite index of sizes
+# and last use times for the least recently used eviction. It is shared by every
+# session and process that runs from the same folder, and survives restarts, so
+# fallback answers, repeated "Speak" presses and common sentences are synthesized
+# once. A cache that cannot be read or written only costs the synthesis.
+class SpeechCache:
+    def __init__(self, folder=None, max_bytes=SPEECH_CACHE_MAX_BYTES):
+        self.folder = folder or os.path.join(os.getcwd(), SPEECH_CACHE_FOLDER)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._cleaned = False
+
+    def _connect(self):
+        os.makedirs(self.folder, exist_ok=True)
+        connection = sqlite3.connect(os.path.join(self.folder, SPEECH_INDEX_FILE), timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(_SCHEMA)
+        return connection
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.mp3")
+
+    def _touch(self, connection, key, language, size):
+        with connection:
+            connection.execute(
+                "INSERT INTO clips (key, language, size, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET last_used = excluded.last_used",
+                (key, language, size, time.time()),
+            )
+
+    # The cached MP3 bytes of text in language, or None
+    def get(self, text, language):
+        key = clip_key(text, language)
+        try:
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+            with closing(self._connect()) as connection:
+                self._touch(connection, key, language, len(audio))
+        except FileNotFoundError:
+            audio = None
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Speech cache read failed: {e}")
+            audio = None
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return audio
+
+    def put(self, text, language, audio):
+        key = clip_key(text, language)
+        path = self._path(key)
+        # written under a temporary name first so a reader never sees half a clip
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(partial, "wb") as f:
+                f.write(audio)
+            os.replace(partial, path)
+            with closing(self._connect()) as connection:
+                self._touch(connection, key, language, len(audio))
+                self._evict(connection)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Speech cache write failed: {e}")
+
+    # Returns the clip of text in language, calling synthesize(text, language) and
+    # storing its result when it is not cached
+    def fetch(self, text, language, synthesize):
+        self._cleanup_once()
+        audio = self.get(text, language)
+        if audio is None:
+            audio = synthesize(text, language)
+            self.put(text, language, audio)
+        return audio
+
+    # Deletes the least recently used clips until the cache fits in max_bytes
+    def _evict(self, connection):
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM clips").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in connection.execute("SELECT key, size FROM clips ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._remove(self._path(key))
+            with connection:
+                connection.execute("DELETE FROM clips WHERE key = ?", (key,))
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # Deletes clip files the index does not know about and unfinished writes, e.g.
+    # from a process that was killed, and forgets indexed clips whose file is gone.
+    # Returns how many files and index rows were removed.
+    def cleanup(self):
+        with closing(self._connect()) as connection:
+            indexed = dict(connection.execute("SELECT key, size FROM clips").fetchall())
+            removed_files = 0
+            now = time.time()
+            for name in os.listdir(self.folder):
+                path = os.path.join(self.folder, name)
+                if name.endswith(".tmp"):
+                    orphan = True
+                elif name.endswith(".mp3"):
+                    orphan = name[: -len(".mp3")] not in indexed
+                else:
+                    continue
+                if orphan and now - os.path.getmtime(path) > ORPHAN_GRACE_SECONDS:
+                    self._remove(path)
+                    removed_files += 1
+            missing = [key for key in indexed if not os.path.isfile(self._path(key))]
+            with connection:
+                connection.executemany("DELETE FROM clips WHERE key = ?", [(key,) for key in missing])
+            self._evict(connection)
+        return removed_files, len(missing)
+
+    def _cleanup_once(self):
+        with self._lock:
+            if self._cleaned:
+                return
+            self._cleaned = True
+        try:
+            self.cleanup()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"Speech cache cleanup failed: {e}")
+
+    def info(self):
+        with closing(self._connect()) as connection:
+            clips, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM clips").fetchone()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "clips": clips,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with closing(self._connect()) as connection:
+            for key, in connection.execute("SELECT key FROM clips").fetchall():
+                self._remove(self._path(key))
+            with connection:
+                connection.execute("DELETE FROM clips")
+        self.cleanup()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+speech_cache = SpeechCache()
+
+
+if __name__ == "__main__":
+    # Removes orphaned clips and prints what the cache holds
+    removed_files, removed_rows = speech_cache.cleanup()
+    print(f"Removed {removed_files} orphaned files and {removed_rows} missing clips")
+    info = speech_cache.info()
+    print(f"{info['clips']} clips, {info['bytes'] / 1024 / 1024:.1f} of {info['max_bytes'] / 1024 / 1024:.0f} MB")
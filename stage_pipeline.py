@@ -0,0 +1,190 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# How a stage ended
+DONE = "done"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+SKIPPED = "skipped"   # a stage it depends on did not finish
+
+
+# One step of a pipeline. run is called with the values of the stages named in
+# after, in that order, as soon as all of them are done. timeout is in seconds.
+class Stage:
+    def __init__(self, name, run, after=(), timeout=None):
+        self.name = name
+        self.run = run
+        self.after = list(after)
+        self.timeout = timeout
+
+
+class StageResult:
+    def __init__(self, name, status, value=None, error=None, seconds=0.0):
+        self.name = name
+        self.status = status
+        self.value = value
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.status == DONE
+
+
+# Streamlit only lets threads that carry the script run context write to the page
+def _script_run_context():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    return get_script_run_ctx(suppress_warning=True)
+
+
+def _attach_context(ctx):
+    if ctx is not None:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+        add_script_run_ctx(threading.current_thread(), ctx)
+
+
+# A stage handed to the thread pool. started is set by the worker when it picks the
+# stage up, so a stage queued behind busy workers is not yet on the clock.
+class _Task:
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = None
+
+
+# Runs a stage on a worker thread and measures how long it took there, so a result
+# that is only collected later still reports its own duration
+def _run_timed(task, inputs):
+    task.started = time.perf_counter()
+    value = task.stage.run(*inputs)
+    return value, time.perf_counter() - task.started
+
+
+# Runs stages on a thread pool, every stage as soon as the stages it depends on are
+# done, so independent stages overlap. Stages can be added while others run, e.g.
+# one per sentence of an answer that is still being generated. A stage that runs
+# past its timeout (counted from when a worker starts it) is given up on, its thread
+# is left to finish in the background, and the stages after it are skipped.
+class Pipeline:
+    def __init__(self, stages=(), max_workers=8):
+        self.results = {}
+        self._pending = {}
+        self._running = {}
+        self._new = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="pipeline",
+            initializer=_attach_context,
+            initargs=(_script_run_context(),),
+        )
+        self.add(*stages)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Stages whose inputs are ready start right away, also when added from on_result
+    def add(self, *stages):
+        for stage in stages:
+            self._pending[stage.name] = stage
+        self._start_ready()
+
+    def _finish(self, result):
+        self.results[result.name] = result
+        self._new.append(result)
+
+    # Start every stage whose inputs are ready and skip those whose inputs failed,
+    # until a pass changes nothing since a skip can unblock others
+    def _start_ready(self):
+        progress = True
+        while progress:
+            progress = False
+            for stage in list(self._pending.values()):
+                if not all(name in self.results for name in stage.after):
+                    continue
+                progress = True
+                del self._pending[stage.name]
+                inputs = [self.results[name] for name in stage.after]
+                if not all(result.ok for result in inputs):
+                    self._finish(StageResult(stage.name, SKIPPED))
+                    continue
+                task = _Task(stage)
+                self._running[self._executor.submit(_run_timed, task, [result.value for result in inputs])] = task
+
+    # Collects the stages that finished or timed out, waiting for the first one (or
+    # the next deadline) when block is set
+    def _step(self, block):
+        self._start_ready()
+        if not self._running:
+            return
+        if block:
+            now = time.perf_counter()
+            # a stage that has not started yet can not time out before a full timeout
+            # from now, the wait is cut there to look at it again
+            deadlines = [
+                (now if task.started is None else task.started) + task.stage.timeout
+                for task in self._running.values()
+                if task.stage.timeout is not None
+            ]
+            wait_seconds = max(min(deadlines) - now, 0) if deadlines else None
+        else:
+            wait_seconds = 0
+        done, _ = wait(self._running, timeout=wait_seconds, return_when=FIRST_COMPLETED)
+
+        now = time.perf_counter()
+        for future in done:
+            task = self._running.pop(future)
+            error = future.exception()
+            if error is None:
+                value, seconds = future.result()
+                self._finish(StageResult(task.stage.name, DONE, value=value, seconds=seconds))
+            else:
+                self._finish(StageResult(task.stage.name, FAILED, error=error, seconds=now - task.started))
+        for future, task in list(self._running.items()):
+            started = task.started
+            if task.stage.timeout is not None and started is not None and now - started >= task.stage.timeout:
+                del self._running[future]
+                future.cancel()
+                self._finish(StageResult(task.stage.name, TIMED_OUT, seconds=now - started))
+        self._start_ready()
+
+    def _take_new(self):
+        new, self._new = self._new, []
+        return new
+
+    # The results that arrived since the last call, without waiting
+    def poll(self):
+        self._step(block=False)
+        return self._take_new()
+
+    # Waits for every stage. on_result is called on the calling thread with each
+    # StageResult as it arrives, which lets a page show partial results right away.
+    # Returns the results by stage name.
+    def wait(self, on_result=None):
+        while True:
+            self._step(block=True)
+            if not self._running:
+                # anything left waits on a stage that does not exist
+                for name in list(self._pending):
+                    del self._pending[name]
+                    self._finish(StageResult(name, SKIPPED))
+            for result in self._take_new():
+                if on_result is not None:
+                    on_result(result)
+            if not self._running and not self._pending:
+                return self.results
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Runs a fixed set of stages to the end, see Pipeline. Returns the results by stage name.
+def run_stages(stages, on_result=None, max_workers=None):
+    with Pipeline(stages, max_workers=max_workers or len(stages)) as pipeline:
+        return pipeline.wait(on_result)
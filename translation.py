@@ -0,0 +1,230 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from instrumentation import timed
+from lazy_imports import lazy_import
+from llm_stream import SentenceSplitter
+
+deep_translator = lazy_import("deep_translator")
+
+TRANSLATION_CACHE_FILE = os.path.join(".data_cache", "translations.sqlite3")
+# Translations kept, the least recently used are dropped first
+TRANSLATION_CACHE_SIZE = 50000
+# Characters sent per request when sentences are translated together. Google
+# Translate takes at most 5000.
+TRANSLATION_BATCH_CHARS = 4500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    translation TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (source, target, text_hash)
+)
+"""
+# Eviction reads the least recently used rows through this index
+_INDEX = "CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)"
+# Every sentence of a batch goes out on its own line behind its number, "[3] ...".
+# A translation is only split back into sentences when every line still starts with
+# the number it was sent with.
+_LINE_MARKER = re.compile(r"\s*\[\s*(\d+)\s*\]\s?(.*)", re.DOTALL)
+# Characters the marker and line break add to a sentence, enough for "[999] \n"
+_LINE_OVERHEAD = 7
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Google Translate through deep_translator, the backend a Translator uses unless it
+# is given another one. A GoogleTranslator keeps the text of the request it is
+# working on in its own attributes, so a client is reused for every request of a
+# language pair, but only on the thread that created it.
+class GoogleBackend:
+    def __init__(self):
+        self._clients = threading.local()
+
+    def _client(self, source, target):
+        clients = getattr(self._clients, "by_pair", None)
+        if clients is None:
+            clients = self._clients.by_pair = {}
+        client = clients.get((source, target))
+        if client is None:
+            client = clients[(source, target)] = deep_translator.GoogleTranslator(source=source, target=target)
+        return client
+
+    def translate(self, text, source, target):
+        return self._client(source, target).translate(text)
+
+
+# Least recently used cache of translated sentences, keyed on (source, target, hash
+# of the text), in SQLite so it survives restarts and is shared by every session
+# and process that runs from the same folder
+class TranslationCache:
+    def __init__(self, path, maxsize=TRANSLATION_CACHE_SIZE):
+        self.path = path
+        self.maxsize = maxsize
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(_SCHEMA)
+        connection.execute(_INDEX)
+        return connection
+
+    # The cached translations of texts, by text
+    def get_many(self, texts, source, target):
+        hashes = {text_hash(text): text for text in texts}
+        if not hashes:
+            return {}
+        with closing(self._connect()) as connection:
+            placeholders = ", ".join("?" * len(hashes))
+            rows = connection.execute(
+                f"SELECT text_hash, translation FROM translations "
+                f"WHERE source = ? AND target = ? AND text_hash IN ({placeholders})",
+                (source, target, *hashes),
+            ).fetchall()
+            with connection:
+                connection.executemany(
+                    "UPDATE translations SET last_used = ? WHERE source = ? AND target = ? AND text_hash = ?",
+                    [(time.time(), source, target, row[0]) for row in rows],
+                )
+        return {hashes[row[0]]: row[1] for row in rows}
+
+    def put_many(self, translations, source, target):
+        now = time.time()
+        with closing(self._connect()) as connection:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO translations (source, target, text_hash, translation, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(source, target, text_hash(text), translation, now) for text, translation in translations.items()],
+                )
+                # only a cache that has grown past maxsize pays for an eviction
+                excess = connection.execute("SELECT COUNT(*) FROM translations").fetchone()[0] - self.maxsize
+                if excess > 0:
+                    connection.execute(
+                        "DELETE FROM translations WHERE rowid IN ("
+                        "SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+                        (excess,),
+                    )
+
+    def size(self):
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def clear(self):
+        with closing(self._connect()) as connection:
+            with connection:
+                connection.execute("DELETE FROM translations")
+
+
+# Translates text a sentence at a time: sentences translated before come from the
+# cache, and the rest are sent together, as few requests as TRANSLATION_BATCH_CHARS
+# allows, one numbered sentence per line. Line breaks and the spacing between
+# sentences are kept. Backend errors are raised to the caller.
+class Translator:
+    def __init__(self, backend=None, cache=None):
+        self.backend = backend or GoogleBackend()
+        self.cache = cache or TranslationCache(os.path.join(os.getcwd(), TRANSLATION_CACHE_FILE))
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def translate(self, text, source, target):
+        if source == target or not text.strip():
+            return text
+        splitter = SentenceSplitter()
+        pieces = splitter.feed(text) + splitter.flush()
+        sentences = [piece.strip() for piece in pieces]
+        translated = self.translate_sentences(sentences, source, target)
+        # every sentence keeps the whitespace that followed it
+        return "".join(
+            translation + piece[len(piece.rstrip()):]
+            for piece, translation in zip(pieces, translated)
+        ).strip()
+
+    # Translations of a list of sentences, in the same order
+    def translate_sentences(self, sentences, source, target):
+        unique = list(dict.fromkeys(sentence for sentence in sentences if sentence))
+        known = self._cached(unique, source, target)
+        missing = [sentence for sentence in unique if sentence not in known]
+        with self._lock:
+            self.hits += len(unique) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            fresh = {}
+            for batch in self._batches(missing):
+                fresh.update(self._request(batch, source, target))
+            self._store(fresh, source, target)
+            known.update(fresh)
+        # a sentence that came back empty is left as it was
+        return [known.get(sentence) or sentence for sentence in sentences]
+
+    def _cached(self, sentences, source, target):
+        try:
+            return self.cache.get_many(sentences, source, target)
+        except sqlite3.Error:
+            return {}
+
+    def _store(self, translations, source, target):
+        translations = {text: translation for text, translation in translations.items() if translation}
+        try:
+            self.cache.put_many(translations, source, target)
+        except sqlite3.Error:
+            pass
+
+    # Splits sentences into groups that fit in one request
+    def _batches(self, sentences):
+        batch, size = [], 0
+        for sentence in sentences:
+            if batch and size + len(sentence) + _LINE_OVERHEAD > TRANSLATION_BATCH_CHARS:
+                yield batch
+                batch, size = [], 0
+            batch.append(sentence)
+            size += len(sentence) + _LINE_OVERHEAD
+        if batch:
+            yield batch
+
+    # Translates a batch in one request. If the translation does not come back as
+    # the numbered lines that were sent, in order, the sentences are sent one at a
+    # time instead, so a sentence is never cached with another one's translation.
+    def _request(self, batch, source, target):
+        if len(batch) == 1:
+            return {batch[0]: self._call(source, target, batch[0]).strip()}
+        numbered = "\n".join(f"[{i}] {sentence}" for i, sentence in enumerate(batch))
+        lines = self._call(source, target, numbered).split("\n")
+        matches = [_LINE_MARKER.fullmatch(line) for line in lines]
+        if len(matches) == len(batch) and all(
+            match is not None and int(match.group(1)) == i for i, match in enumerate(matches)
+        ):
+            return {sentence: match.group(2).strip() for sentence, match in zip(batch, matches)}
+        return {sentence: self._call(source, target, sentence).strip() for sentence in batch}
+
+    @timed("translation.request")
+    def _call(self, source, target, text):
+        with self._lock:
+            self.requests += 1
+        return self.backend.translate(text, source, target) or ""
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "requests": self.requests,
+                "size": self.cache.size(),
+                "maxsize": self.cache.maxsize,
+            }
+
+
+translator = Translator()